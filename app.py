@@ -1,13 +1,15 @@
+import asyncio
 import base64
 import html
-import json
 import os
 import socket
 import threading
 import uuid
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Tuple
 
+import orjson
 from fastapi import FastAPI, Request, Response, UploadFile, File, Form
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import HTMLResponse, JSONResponse
@@ -26,6 +28,12 @@ BG_PATH = os.path.abspath(os.path.join(IMG_DIR, "login_background.png"))
 LOGO_PATH = os.path.abspath(os.path.join(IMG_DIR, "logo.png"))
 UPLOADS_DIR = os.path.abspath(os.path.join(BASE_DIR, "data", "uploads"))
 DEFAULT_DEMO_PASSWORD = os.getenv("DEMO_DEFAULT_PASSWORD", "Demo@123")
+TMP_DIRS = tuple(
+    os.path.abspath(os.path.join(BASE_DIR, "data", name))
+    for name in ("tmp_images", "tmp_audio", "tmp_requests", "tmp_assess", "tmp_handover")
+)
+TMP_REAP_INTERVAL_SEC = float(os.getenv("TMP_REAP_INTERVAL_SEC", "300"))
+TMP_MAX_AGE_SEC = float(os.getenv("TMP_MAX_AGE_SEC", "3600"))
 
 # Configure default environment variables for MedGemma and ASR models (e.g., CPU fallback, token limits)
 # Keep GPU headroom for MedGemma inference on 8GB-class cards.
@@ -38,6 +46,11 @@ os.environ.setdefault("MEDGEMMA_MAX_INPUT_TOKENS", "2048")
 os.environ.setdefault("RAG_EVIDENCE_TOTAL_CHARS", "1500")
 
 
+class ORJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
 # Helper function: Convert local image files to Base64 data URIs for inline HTML rendering
 def _b64_data_uri(path: str) -> str:
     try:
@@ -1138,15 +1151,20 @@ _SESSIONS: Dict[str, dict] = {}
 _SESSIONS_LOCK = threading.Lock()
 
 
-def _get_session_id(request: Request, response: Optional[Response] = None) -> str:
+def _read_session_id(request: Request) -> Tuple[str, bool]:
     sid = request.cookies.get("wl_session")
     with _SESSIONS_LOCK:
-        if not sid or sid not in _SESSIONS:
-            sid = uuid.uuid4().hex
-            _SESSIONS[sid] = patient_app.default_state()
-    if response is not None:
+        if sid and sid in _SESSIONS:
+            return sid, False
+        sid = uuid.uuid4().hex
+        _SESSIONS[sid] = patient_app.default_state()
+    return sid, True
+
+
+def _attach_session_cookie(response: Response, sid: str, fresh: bool) -> Response:
+    if fresh:
         response.set_cookie("wl_session", sid, httponly=True, samesite="lax")
-    return sid
+    return response
 
 
 def _get_state(sid: str) -> dict:
@@ -1670,7 +1688,7 @@ def _build_ctx() -> dict:
 
     def ui_onclick(action_id: str, payload: Optional[dict] = None) -> str:
         payload = payload or {}
-        payload_str = json.dumps(payload, ensure_ascii=False)
+        payload_str = orjson.dumps(payload).decode("utf-8")
         js = f"(function(){{wlApi('{action_id}', {payload_str});}})(); return false;"
         return html.escape(js, quote=True)
 
@@ -1733,27 +1751,79 @@ def _render_app_html(state: dict) -> str:
     return _render_login_html("")
 
 
-app = FastAPI()
+def _referenced_tmp_paths() -> set:
+    # Attachments wait in session state ("*_path" keys) until the user submits.
+    with _SESSIONS_LOCK:
+        states = list(_SESSIONS.values())
+    return {
+        os.path.abspath(value)
+        for state in states
+        for key, value in state.items()
+        if key.endswith("_path") and isinstance(value, str) and value
+    }
+
+
+def _reap_tmp_dirs(max_age_sec: float) -> int:
+    # Upload handlers park files here until a background worker or a later
+    # action consumes them; anything older than max_age_sec that no live
+    # session still points at was abandoned.
+    now = datetime.now().timestamp()
+    in_use = _referenced_tmp_paths()
+    removed = 0
+    for tmp_dir in TMP_DIRS:
+        try:
+            entries = list(os.scandir(tmp_dir))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if not entry.is_file(follow_symlinks=False) or entry.path in in_use:
+                    continue
+                if now - entry.stat(follow_symlinks=False).st_mtime > max_age_sec:
+                    os.unlink(entry.path)
+                    removed += 1
+            except Exception:
+                continue
+    return removed
+
+
+async def _reap_tmp_loop() -> None:
+    while True:
+        try:
+            await asyncio.to_thread(_reap_tmp_dirs, TMP_MAX_AGE_SEC)
+        except Exception:
+            pass
+        await asyncio.sleep(max(1.0, TMP_REAP_INTERVAL_SEC))
+
+
+@asynccontextmanager
+async def _lifespan(app: FastAPI):
+    reaper = asyncio.create_task(_reap_tmp_loop()) if TMP_MAX_AGE_SEC > 0 else None
+    try:
+        yield
+    finally:
+        if reaper is not None:
+            reaper.cancel()
+
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=_lifespan)
 os.makedirs(UPLOADS_DIR, exist_ok=True)
 app.mount("/uploads", StaticFiles(directory=UPLOADS_DIR), name="uploads")
 
 
 @app.get("/", response_class=HTMLResponse)
 def index(request: Request, response: Response):
-    sid = _get_session_id(request, response)
+    sid, fresh = _read_session_id(request)
     state = _get_state(sid)
-    return HTMLResponse(_render_app_html(state))
+    return _attach_session_cookie(HTMLResponse(_render_app_html(state)), sid, fresh)
 
 
 @app.post("/api/register")
 def api_register(request: Request, response: Response, payload: Dict[str, Any]):
-    init_resp = JSONResponse({"ok": False})
-    sid = _get_session_id(request, init_resp)
+    sid, fresh = _read_session_id(request)
 
-    def _register_resp(data: Dict[str, Any]) -> JSONResponse:
-        resp = JSONResponse(data)
-        resp.set_cookie("wl_session", sid, httponly=True, samesite="lax")
-        return resp
+    def _register_resp(data: Dict[str, Any]) -> ORJSONResponse:
+        return _attach_session_cookie(ORJSONResponse(data), sid, fresh)
 
     role = str(payload.get("role") or "").strip().lower()
     account = str(payload.get("account") or "").strip()
@@ -1837,14 +1907,11 @@ def api_register(request: Request, response: Response, payload: Dict[str, Any]):
 
 @app.post("/api/login")
 def api_login(request: Request, response: Response, payload: Dict[str, Any]):
-    init_resp = JSONResponse({"ok": False})
-    sid = _get_session_id(request, init_resp)
+    sid, fresh = _read_session_id(request)
     state = _get_state(sid)
 
-    def _login_resp(data: Dict[str, Any]) -> JSONResponse:
-        resp = JSONResponse(data)
-        resp.set_cookie("wl_session", sid, httponly=True, samesite="lax")
-        return resp
+    def _login_resp(data: Dict[str, Any]) -> ORJSONResponse:
+        return _attach_session_cookie(ORJSONResponse(data), sid, fresh)
 
     account = (payload.get("account") or "").strip()
     password = str(payload.get("password") or "")
@@ -1962,7 +2029,7 @@ def api_login(request: Request, response: Response, payload: Dict[str, Any]):
 
 @app.post("/api/logout")
 def api_logout(request: Request, response: Response):
-    resp = JSONResponse({"ok": True})
+    resp = ORJSONResponse({"ok": True})
     sid = request.cookies.get("wl_session")
     if sid:
         with _SESSIONS_LOCK:
@@ -1973,12 +2040,11 @@ def api_logout(request: Request, response: Response):
 
 @app.post("/api/action")
 def api_action(request: Request, response: Response, payload: Dict[str, Any]):
-    resp = JSONResponse({})
-    sid = _get_session_id(request, resp)
+    sid, fresh = _read_session_id(request)
     state = _get_state(sid)
     action = payload.get("action") or ""
     data = payload.get("payload") or {}
-    data_str = json.dumps(data, ensure_ascii=False)
+    data_str = orjson.dumps(data).decode("utf-8")
 
     role = state.get("role")
     state_only_actions = {
@@ -2068,7 +2134,7 @@ def api_action(request: Request, response: Response, payload: Dict[str, Any]):
     elif role == "patient" and action in patient_payload_actions:
         fn = patient_payload_actions[action]
         if action == "chat_send":
-            state, _ = fn(data_str, None, state)
+            state, _ = fn(data, None, state)
         else:
             state, _ = fn(data_str, state)
     elif role == "nurse" and action in nurse_payload_actions:
@@ -2095,15 +2161,12 @@ def api_action(request: Request, response: Response, payload: Dict[str, Any]):
         if state.get("role") == "patient"
         else (staff_pages.render_nurse_page(state, ctx) if state.get("role") == "nurse" else staff_pages.render_doctor_page(state, ctx))
     )
-    resp = JSONResponse({"html": html_out, "chat_pending": bool(state.get("chat_pending")), "toast": toast_msg})
-    _get_session_id(request, resp)
-    return resp
+    return _attach_session_cookie(ORJSONResponse({"html": html_out, "chat_pending": bool(state.get("chat_pending")), "toast": toast_msg}), sid, fresh)
 
 
 @app.get("/api/chat_poll")
 def api_chat_poll(request: Request, response: Response):
-    resp = JSONResponse({})
-    sid = _get_session_id(request, resp)
+    sid, fresh = _read_session_id(request)
     state = _get_state(sid)
     state, _ = patient_app.poll_chat_updates(state)
     _set_state(sid, state)
@@ -2113,9 +2176,24 @@ def api_chat_poll(request: Request, response: Response):
         if state.get("role") == "patient"
         else (staff_pages.render_nurse_page(state, ctx) if state.get("role") == "nurse" else staff_pages.render_doctor_page(state, ctx))
     )
-    resp = JSONResponse({"html": html_out, "chat_pending": bool(state.get("chat_pending"))})
-    _get_session_id(request, resp)
-    return resp
+    return _attach_session_cookie(ORJSONResponse({"html": html_out, "chat_pending": bool(state.get("chat_pending"))}), sid, fresh)
+
+
+async def _save_upload(file: UploadFile, subdir: str, prefix: str, default_ext: str) -> str:
+    ext = os.path.splitext(file.filename or "")[1] or default_ext
+    tmp_dir = os.path.join(BASE_DIR, "data", subdir)
+    tmp_path = os.path.join(tmp_dir, f"{prefix}_{uuid.uuid4().hex}{ext}")
+    content = await file.read()
+
+    def _write() -> None:
+        os.makedirs(tmp_dir, exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+
+    # Async handlers share the event loop; blocking disk writes and the
+    # synchronous UI-layer calls go through worker threads instead.
+    await asyncio.to_thread(_write)
+    return tmp_path
 
 
 @app.post("/api/chat_image")
@@ -2125,24 +2203,15 @@ async def api_chat_image(
     message: str = Form(""),
     page: str = Form(""),
 ):
-    resp = JSONResponse({})
-    sid = _get_session_id(request, resp)
+    sid, fresh = _read_session_id(request)
     state = _get_state(sid)
-    ext = os.path.splitext(file.filename or "")[1] or ".png"
-    tmp_dir = os.path.join(BASE_DIR, "data", "tmp_images")
-    os.makedirs(tmp_dir, exist_ok=True)
-    tmp_path = os.path.join(tmp_dir, f"chat_{uuid.uuid4().hex}{ext}")
-    content = await file.read()
-    with open(tmp_path, "wb") as f:
-        f.write(content)
+    tmp_path = await _save_upload(file, "tmp_images", "chat", ".png")
     payload = {"message": message, "current_page": page}
-    state, _ = patient_app.chat_send(json.dumps(payload, ensure_ascii=False), tmp_path, state)
+    state, _ = await asyncio.to_thread(patient_app.chat_send, payload, tmp_path, state)
     _set_state(sid, state)
     ctx = _build_ctx()
     html_out = patient_pages.render_patient_page(state, ctx)
-    resp = JSONResponse({"html": html_out, "chat_pending": bool(state.get("chat_pending"))})
-    _get_session_id(request, resp)
-    return resp
+    return _attach_session_cookie(ORJSONResponse({"html": html_out, "chat_pending": bool(state.get("chat_pending"))}), sid, fresh)
 
 
 @app.post("/api/chat_voice")
@@ -2152,24 +2221,15 @@ async def api_chat_voice(
     message: str = Form(""),
     page: str = Form(""),
 ):
-    resp = JSONResponse({})
-    sid = _get_session_id(request, resp)
+    sid, fresh = _read_session_id(request)
     state = _get_state(sid)
-    ext = os.path.splitext(file.filename or "")[1] or ".webm"
-    tmp_dir = os.path.join(BASE_DIR, "data", "tmp_audio")
-    os.makedirs(tmp_dir, exist_ok=True)
-    tmp_path = os.path.join(tmp_dir, f"chat_{uuid.uuid4().hex}{ext}")
-    content = await file.read()
-    with open(tmp_path, "wb") as f:
-        f.write(content)
+    tmp_path = await _save_upload(file, "tmp_audio", "chat", ".webm")
     payload = {"message": message, "audio_path": tmp_path, "current_page": page}
-    state, _ = patient_app.chat_send(json.dumps(payload, ensure_ascii=False), None, state)
+    state, _ = await asyncio.to_thread(patient_app.chat_send, payload, None, state)
     _set_state(sid, state)
     ctx = _build_ctx()
     html_out = patient_pages.render_patient_page(state, ctx)
-    resp = JSONResponse({"html": html_out, "chat_pending": bool(state.get("chat_pending"))})
-    _get_session_id(request, resp)
-    return resp
+    return _attach_session_cookie(ORJSONResponse({"html": html_out, "chat_pending": bool(state.get("chat_pending"))}), sid, fresh)
 
 
 @app.post("/api/request_nurse_image")
@@ -2179,26 +2239,17 @@ async def api_request_nurse_image(
     detail: str = Form(""),
     page: str = Form(""),
 ):
-    resp = JSONResponse({})
-    sid = _get_session_id(request, resp)
+    sid, fresh = _read_session_id(request)
     state = _get_state(sid)
-    ext = os.path.splitext(file.filename or "")[1] or ".png"
-    tmp_dir = os.path.join(BASE_DIR, "data", "tmp_requests")
-    os.makedirs(tmp_dir, exist_ok=True)
-    tmp_path = os.path.join(tmp_dir, f"request_img_{uuid.uuid4().hex}{ext}")
-    content = await file.read()
-    with open(tmp_path, "wb") as f:
-        f.write(content)
-    state, _ = patient_app.request_nurse_attach_image(tmp_path, detail, page, state)
+    tmp_path = await _save_upload(file, "tmp_requests", "request_img", ".png")
+    state, _ = await asyncio.to_thread(patient_app.request_nurse_attach_image, tmp_path, detail, page, state)
     toast_msg = str(state.get("toast") or "")
     if toast_msg:
         state["toast"] = ""
     _set_state(sid, state)
     ctx = _build_ctx()
     html_out = patient_pages.render_patient_page(state, ctx)
-    resp = JSONResponse({"html": html_out, "chat_pending": bool(state.get("chat_pending")), "toast": toast_msg})
-    _get_session_id(request, resp)
-    return resp
+    return _attach_session_cookie(ORJSONResponse({"html": html_out, "chat_pending": bool(state.get("chat_pending")), "toast": toast_msg}), sid, fresh)
 
 
 @app.post("/api/request_nurse_audio")
@@ -2208,26 +2259,17 @@ async def api_request_nurse_audio(
     detail: str = Form(""),
     page: str = Form(""),
 ):
-    resp = JSONResponse({})
-    sid = _get_session_id(request, resp)
+    sid, fresh = _read_session_id(request)
     state = _get_state(sid)
-    ext = os.path.splitext(file.filename or "")[1] or ".webm"
-    tmp_dir = os.path.join(BASE_DIR, "data", "tmp_requests")
-    os.makedirs(tmp_dir, exist_ok=True)
-    tmp_path = os.path.join(tmp_dir, f"request_audio_{uuid.uuid4().hex}{ext}")
-    content = await file.read()
-    with open(tmp_path, "wb") as f:
-        f.write(content)
-    state, _ = patient_app.request_nurse_attach_audio(tmp_path, detail, page, state)
+    tmp_path = await _save_upload(file, "tmp_requests", "request_audio", ".webm")
+    state, _ = await asyncio.to_thread(patient_app.request_nurse_attach_audio, tmp_path, detail, page, state)
     toast_msg = str(state.get("toast") or "")
     if toast_msg:
         state["toast"] = ""
     _set_state(sid, state)
     ctx = _build_ctx()
     html_out = patient_pages.render_patient_page(state, ctx)
-    resp = JSONResponse({"html": html_out, "chat_pending": bool(state.get("chat_pending")), "toast": toast_msg})
-    _get_session_id(request, resp)
-    return resp
+    return _attach_session_cookie(ORJSONResponse({"html": html_out, "chat_pending": bool(state.get("chat_pending")), "toast": toast_msg}), sid, fresh)
 
 
 @app.post("/api/assessment_image")
@@ -2235,16 +2277,9 @@ async def api_assessment_image(
     request: Request,
     file: UploadFile = File(...),
 ):
-    resp = JSONResponse({})
-    sid = _get_session_id(request, resp)
+    sid, fresh = _read_session_id(request)
     state = _get_state(sid)
-    ext = os.path.splitext(file.filename or "")[1] or ".png"
-    tmp_dir = os.path.join(BASE_DIR, "data", "tmp_assess")
-    os.makedirs(tmp_dir, exist_ok=True)
-    tmp_path = os.path.join(tmp_dir, f"assess_{uuid.uuid4().hex}{ext}")
-    content = await file.read()
-    with open(tmp_path, "wb") as f:
-        f.write(content)
+    tmp_path = await _save_upload(file, "tmp_assess", "assess", ".png")
     if state.get("role") == "nurse":
         state = nurse_app.assessment_attach_image(tmp_path, state)
     _set_state(sid, state)
@@ -2254,9 +2289,7 @@ async def api_assessment_image(
         if state.get("role") == "patient"
         else (staff_pages.render_nurse_page(state, ctx) if state.get("role") == "nurse" else staff_pages.render_doctor_page(state, ctx))
     )
-    resp = JSONResponse({"html": html_out, "chat_pending": bool(state.get("chat_pending"))})
-    _get_session_id(request, resp)
-    return resp
+    return _attach_session_cookie(ORJSONResponse({"html": html_out, "chat_pending": bool(state.get("chat_pending"))}), sid, fresh)
 
 
 @app.post("/api/handover_forward_image")
@@ -2266,16 +2299,9 @@ async def api_handover_forward_image(
     forward_text: str = Form(""),
     target_staff_id: str = Form(""),
 ):
-    resp = JSONResponse({})
-    sid = _get_session_id(request, resp)
+    sid, fresh = _read_session_id(request)
     state = _get_state(sid)
-    ext = os.path.splitext(file.filename or "")[1] or ".png"
-    tmp_dir = os.path.join(BASE_DIR, "data", "tmp_handover")
-    os.makedirs(tmp_dir, exist_ok=True)
-    tmp_path = os.path.join(tmp_dir, f"handover_{uuid.uuid4().hex}{ext}")
-    content = await file.read()
-    with open(tmp_path, "wb") as f:
-        f.write(content)
+    tmp_path = await _save_upload(file, "tmp_handover", "handover", ".png")
     if state.get("role") == "nurse":
         state["handover_forward_text"] = str(forward_text or "")
         state["handover_forward_target_staff_id"] = str(target_staff_id or "").strip()
@@ -2287,9 +2313,7 @@ async def api_handover_forward_image(
         if state.get("role") == "patient"
         else (staff_pages.render_nurse_page(state, ctx) if state.get("role") == "nurse" else staff_pages.render_doctor_page(state, ctx))
     )
-    resp = JSONResponse({"html": html_out, "chat_pending": bool(state.get("chat_pending"))})
-    _get_session_id(request, resp)
-    return resp
+    return _attach_session_cookie(ORJSONResponse({"html": html_out, "chat_pending": bool(state.get("chat_pending"))}), sid, fresh)
 
 
 @app.post("/api/handover_forward_audio")
@@ -2299,16 +2323,9 @@ async def api_handover_forward_audio(
     forward_text: str = Form(""),
     target_staff_id: str = Form(""),
 ):
-    resp = JSONResponse({})
-    sid = _get_session_id(request, resp)
+    sid, fresh = _read_session_id(request)
     state = _get_state(sid)
-    ext = os.path.splitext(file.filename or "")[1] or ".webm"
-    tmp_dir = os.path.join(BASE_DIR, "data", "tmp_handover")
-    os.makedirs(tmp_dir, exist_ok=True)
-    tmp_path = os.path.join(tmp_dir, f"handover_{uuid.uuid4().hex}{ext}")
-    content = await file.read()
-    with open(tmp_path, "wb") as f:
-        f.write(content)
+    tmp_path = await _save_upload(file, "tmp_handover", "handover", ".webm")
     if state.get("role") == "nurse":
         state["handover_forward_text"] = str(forward_text or "")
         state["handover_forward_target_staff_id"] = str(target_staff_id or "").strip()
@@ -2320,9 +2337,7 @@ async def api_handover_forward_audio(
         if state.get("role") == "patient"
         else (staff_pages.render_nurse_page(state, ctx) if state.get("role") == "nurse" else staff_pages.render_doctor_page(state, ctx))
     )
-    resp = JSONResponse({"html": html_out, "chat_pending": bool(state.get("chat_pending"))})
-    _get_session_id(request, resp)
-    return resp
+    return _attach_session_cookie(ORJSONResponse({"html": html_out, "chat_pending": bool(state.get("chat_pending"))}), sid, fresh)
 
 
 @app.post("/api/assessment_audio")
@@ -2330,16 +2345,9 @@ async def api_assessment_audio(
     request: Request,
     file: UploadFile = File(...),
 ):
-    resp = JSONResponse({})
-    sid = _get_session_id(request, resp)
+    sid, fresh = _read_session_id(request)
     state = _get_state(sid)
-    ext = os.path.splitext(file.filename or "")[1] or ".webm"
-    tmp_dir = os.path.join(BASE_DIR, "data", "tmp_assess")
-    os.makedirs(tmp_dir, exist_ok=True)
-    tmp_path = os.path.join(tmp_dir, f"assess_{uuid.uuid4().hex}{ext}")
-    content = await file.read()
-    with open(tmp_path, "wb") as f:
-        f.write(content)
+    tmp_path = await _save_upload(file, "tmp_assess", "assess", ".webm")
     if state.get("role") == "nurse":
         state = nurse_app.assessment_attach_audio(tmp_path, state)
     _set_state(sid, state)
@@ -2349,9 +2357,7 @@ async def api_assessment_audio(
         if state.get("role") == "patient"
         else (staff_pages.render_nurse_page(state, ctx) if state.get("role") == "nurse" else staff_pages.render_doctor_page(state, ctx))
     )
-    resp = JSONResponse({"html": html_out, "chat_pending": bool(state.get("chat_pending"))})
-    _get_session_id(request, resp)
-    return resp
+    return _attach_session_cookie(ORJSONResponse({"html": html_out, "chat_pending": bool(state.get("chat_pending"))}), sid, fresh)
 
 
 if __name__ == "__main__":
@@ -2513,7 +2519,19 @@ if __name__ == "__main__":
     else:
         print("[startup] Public URL: unavailable (install cloudflared or configure ngrok token).")
 
+    # Sessions, pending chat results and the loaded models all live in this
+    # process, so throughput comes from uvloop/httptools (uvicorn[standard])
+    # rather than extra workers.
     try:
-        uvicorn.run(app, host=host, port=port)
+        uvicorn.run(
+            app,
+            host=host,
+            port=port,
+            loop=str(os.getenv("UVICORN_LOOP", "auto") or "auto").strip(),
+            http=str(os.getenv("UVICORN_HTTP", "auto") or "auto").strip(),
+            backlog=int(os.getenv("UVICORN_BACKLOG", "2048")),
+            proxy_headers=True,
+            forwarded_allow_ips=str(os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1") or "127.0.0.1").strip(),
+        )
     finally:
         _stop_public_tunnel(tunnel)
@@ -1,11 +1,12 @@
 # src/agents/asr.py
 import os
 import re
-import tempfile
-from typing import Optional, Tuple, Dict, Any, List
+import threading
+from typing import Optional, Tuple, Dict, Any, Iterator, List
 
+import numpy as np
 import torch
-from transformers import AutoProcessor, AutoModelForCTC
+from transformers import AutoProcessor, AutoModelForCTC, BatchFeature
 
 # ====== Hard constraint: ONLY MedASR ======
 MEDASR_MODEL_ID = "google/medasr"
@@ -19,6 +20,16 @@ MED_ASR_DEBUG_ENV = "MED_ASR_DEBUG"
 
 MED_ASR_CHUNK_LENGTH_S_ENV = "MED_ASR_CHUNK_LENGTH_S"   
 MED_ASR_STRIDE_LENGTH_S_ENV = "MED_ASR_STRIDE_LENGTH_S" 
+MED_ASR_BATCH_SIZE_ENV = "MED_ASR_BATCH_SIZE"
+MED_ASR_COMPILE_ENV = "MED_ASR_COMPILE"
+MED_ASR_VAD_ENV = "MED_ASR_VAD"
+MED_ASR_VAD_RATIO_ENV = "MED_ASR_VAD_RATIO"
+MED_ASR_LOAD_TIMEOUT_S_ENV = "MED_ASR_LOAD_TIMEOUT_S"
+MED_ASR_QUANT_ENV = "MED_ASR_QUANT"  # off | int8 (opt-in, CPU only)
+
+# Energy VAD framing at 16 kHz: 25 ms window, 10 ms hop.
+_VAD_FRAME = 400
+_VAD_HOP = 160
 
 _REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
 DEFAULT_HF_CACHE_DIR = os.path.join(_REPO_ROOT, "models")
@@ -75,25 +86,34 @@ def _ensure_ffmpeg_and_pydub() -> None:
         ) from exc
 
 
-def _normalize_audio_to_wav16k_mono(audio_path: str, force_resample_wav: bool = True) -> Tuple[str, bool]:
-   
+_PCM_DTYPES = {1: torch.int8, 2: torch.int16, 4: torch.int32}
+
+
+def _load_audio(audio_path: str) -> Tuple[torch.Tensor, int]:
+    """
+    Decode audio in-process into a (C, T) float tensor. torchaudio handles
+    wav/flac/mp3 directly; pydub+ffmpeg is only used for containers the
+    installed torchaudio backend cannot open (e.g. browser webm/ogg).
+    """
     if not audio_path:
         raise ValueError("audio_path is empty")
 
-    _ensure_ffmpeg_and_pydub()
-    from pydub import AudioSegment
+    import torchaudio
 
-    lower = audio_path.lower()
-    if lower.endswith(".wav") and not force_resample_wav:
-        return audio_path, False
+    try:
+        return torchaudio.load(audio_path)
+    except Exception:
+        pass
 
-    audio = AudioSegment.from_file(audio_path)
-    audio = audio.set_frame_rate(16000).set_channels(1)
+    _ensure_ffmpeg_and_pydub()
+    from pydub import AudioSegment
 
-    tmp = tempfile.NamedTemporaryFile(suffix=".wav", delete=False)
-    tmp.close()
-    audio.export(tmp.name, format="wav")
-    return tmp.name, True
+    audio = AudioSegment.from_file(audio_path).set_channels(1)
+    if audio.sample_width not in _PCM_DTYPES:
+        audio = audio.set_sample_width(2)
+    pcm = torch.frombuffer(bytearray(audio.raw_data), dtype=_PCM_DTYPES[audio.sample_width])
+    scale = float(1 << (8 * audio.sample_width - 1))
+    return (pcm.to(torch.float32) / scale).unsqueeze(0), int(audio.frame_rate)
 
 
 def _from_pretrained_compat(fn, *, token: Optional[str], trust_remote_code: bool, **kwargs):
@@ -108,55 +128,66 @@ def _from_pretrained_compat(fn, *, token: Optional[str], trust_remote_code: bool
         return fn(**kwargs, trust_remote_code=trust_remote_code)
 
 
-def _to_device_and_dtype(batch: Dict[str, Any], device: torch.device, dtype: torch.dtype) -> Dict[str, Any]:
-    out: Dict[str, Any] = {}
-    for k, v in batch.items():
-        if torch.is_tensor(v):
-            v = v.to(device)
-            if v.is_floating_point():
-                v = v.to(dtype=dtype)
-        out[k] = v
-    return out
+def _to_device_and_dtype(batch: Any, device: torch.device, dtype: torch.dtype) -> Dict[str, Any]:
+    # One fused copy+cast per tensor; only floating-point inputs take the model dtype.
+    if isinstance(batch, BatchFeature):
+        return batch.to(device=device, dtype=dtype)
+    return {
+        k: (
+            v.to(device=device, dtype=dtype if v.is_floating_point() else v.dtype, non_blocking=v.is_pinned())
+            if torch.is_tensor(v)
+            else v
+        )
+        for k, v in batch.items()
+    }
+
+
+_SENTENCE_TAG_RE = re.compile(r"</?s>")
+_SPOKEN_PUNCT = {
+    "period": ".",
+    "comma": ",",
+    "colon": ":",
+    "semicolon": ";",
+    "question": "?",
+    "exclamation": "!",
+    "new paragraph": "\n",
+    "newline": "\n",
+}
+_SPOKEN_PUNCT_RE = re.compile(r"\{(" + "|".join(re.escape(k) for k in _SPOKEN_PUNCT) + r")\}")
+_INLINE_WS_RE = re.compile(r"[ \t]+")
+_SPACE_BEFORE_PUNCT_RE = re.compile(r"\s+([.,:;!?])")
 
 
 def _post_clean(text: str) -> str:
     
     if not text:
         return ""
-    t = text.strip()
-
-    t = t.replace("</s>", "").replace("<s>", "").strip()
-
-    rep = {
-        "{period}": ".",
-        "{comma}": ",",
-        "{colon}": ":",
-        "{semicolon}": ";",
-        "{question}": "?",
-        "{exclamation}": "!",
-        "{new paragraph}": "\n",
-        "{newline}": "\n",
-    }
-    for k, v in rep.items():
-        t = t.replace(k, v)
-
-    t = re.sub(r"[ \t]+", " ", t)
-    t = re.sub(r"\s+([.,:;!?])", r"\1", t)
+    t = _SENTENCE_TAG_RE.sub("", text.strip()).strip()
+    t = _SPOKEN_PUNCT_RE.sub(lambda m: _SPOKEN_PUNCT[m.group(1)], t)
+    t = _INLINE_WS_RE.sub(" ", t)
+    t = _SPACE_BEFORE_PUNCT_RE.sub(r"\1", t)
     return t.strip()
 
 
-def _ctc_collapse(ids: List[int], blank_id: Optional[int]) -> List[int]:
-   
-    collapsed: List[int] = []
-    prev = None
-    for i in ids:
-        if prev is not None and i == prev:
-            continue
-        prev = i
-        if blank_id is not None and i == blank_id:
-            continue
-        collapsed.append(i)
-    return collapsed
+def _ctc_collapse(ids: torch.Tensor, drop_ids: Optional[torch.Tensor]) -> List[List[int]]:
+    """
+    ids: (B, T) greedy CTC token ids. Per row, drops consecutive repeats and
+    then the blank/special ids in drop_ids with one vectorized mask, so only
+    the collapsed ids leave the device.
+    """
+    if ids.dim() == 1:
+        ids = ids.unsqueeze(0)
+    keep = torch.ones_like(ids, dtype=torch.bool)
+    keep[:, 1:] = ids[:, 1:] != ids[:, :-1]
+    if drop_ids is not None and drop_ids.numel() > 0:
+        keep &= ~torch.isin(ids, drop_ids.to(ids.device))
+    return [row[mask].tolist() for row, mask in zip(ids, keep)]
+
+
+class _LoadAttempt:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.error: Optional[BaseException] = None
 
 
 class MedASRTranscriber:
@@ -177,8 +208,51 @@ class MedASRTranscriber:
 
         self.chunk_length_s = int(os.getenv(MED_ASR_CHUNK_LENGTH_S_ENV, "20"))
         self.stride_length_s = int(os.getenv(MED_ASR_STRIDE_LENGTH_S_ENV, "2"))
+        self.batch_size = max(1, int(os.getenv(MED_ASR_BATCH_SIZE_ENV, "8")))
         self.force_resample_wav = bool(force_resample_wav)
-
+        self._resamplers: Dict[int, Any] = {}
+        self.vad_enabled = os.getenv(MED_ASR_VAD_ENV, "1").strip().lower() in ("1", "true", "yes", "y")
+        self.vad_ratio = float(os.getenv(MED_ASR_VAD_RATIO_ENV, "1e-3"))
+        self.quant = os.getenv(MED_ASR_QUANT_ENV, "off").strip().lower()
+
+        # Weights load on a background thread so constructing the transcriber
+        # does not block startup; transcribe() waits in _ensure_ready() before first use.
+        self.load_timeout_s = float(os.getenv(MED_ASR_LOAD_TIMEOUT_S_ENV, "600"))
+        self._load_lock = threading.Lock()
+        self._start_load()
+
+    def _start_load(self) -> None:
+        attempt = _LoadAttempt()
+        self._attempt = attempt
+        threading.Thread(
+            target=self._load_in_background, args=(attempt,), name="medasr-load", daemon=True
+        ).start()
+
+    def _load_in_background(self, attempt: "_LoadAttempt") -> None:
+        try:
+            self._load()
+        except BaseException as exc:
+            attempt.error = exc
+            print(f"[MedASR] Load failed: {exc}")
+        finally:
+            attempt.done.set()
+
+    def _ensure_ready(self) -> None:
+        attempt = self._attempt
+        if not attempt.done.wait(timeout=self.load_timeout_s):
+            raise RuntimeError(f"MedASR is still loading after {self.load_timeout_s:.0f}s")
+        error = attempt.error
+        if error is None:
+            return
+        # A transient failure (download, OOM) must not disable ASR for the life of
+        # the process: the first caller to see it kicks off a fresh load.
+        with self._load_lock:
+            if self._attempt is attempt:
+                print("[MedASR] Retrying load in the background")
+                self._start_load()
+        raise RuntimeError(f"MedASR failed to load: {error}") from error
+
+    def _load(self) -> None:
         token = _hf_token()
         trust_remote_code = True  
 
@@ -196,60 +270,153 @@ class MedASRTranscriber:
             trust_remote_code=trust_remote_code,
             pretrained_model_name_or_path=self.model_id,
             cache_dir=DEFAULT_HF_CACHE_DIR,
+            torch_dtype=self.dtype,
+            low_cpu_mem_usage=True,
         ).to(self.device)
 
-        self.model = self.model.to(dtype=self.dtype).eval()
+        self.model = self.model.eval()
+
+        # FP32 on CPU is compute-bound; dynamic INT8 on the Linear layers is the
+        # cheap win for CTC encoders, but it is opt-in: check transcripts against
+        # the FP32 model before enabling it. CUDA keeps FP16.
+        if self.quant == "int8" and self.device.type == "cpu":
+            try:
+                self.model = torch.ao.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+            except Exception as exc:
+                print(f"[MedASR] INT8 quantization unavailable, using FP32: {exc}")
+        elif self.quant not in ("int8", "off", ""):
+            print(f"[MedASR] Unsupported {MED_ASR_QUANT_ENV}={self.quant!r}; using {self.dtype}")
+
+        # Opt-in compile of the CTC forward (generate() is forward + argmax). Inputs
+        # are padded to one chunk length and a full batch below so shapes stay static.
+        # No CUDA graphs: warmup runs on the load thread, requests on worker threads.
+        self._eager_forward = None
+        compile_on = os.getenv(MED_ASR_COMPILE_ENV, "0").strip().lower() in ("1", "true", "yes", "y")
+        if compile_on and self.device.type == "cuda" and hasattr(torch, "compile"):
+            try:
+                self._eager_forward = self.model.forward
+                self.model.forward = torch.compile(self.model.forward, fullgraph=False)
+            except Exception as exc:
+                print(f"[MedASR] torch.compile unavailable, using eager forward: {exc}")
+                self._eager_forward = None
 
         
         self.tokenizer = getattr(self.processor, "tokenizer", None)
         blank_id = None
+        special_ids: set = set()
         if self.tokenizer is not None:
             try:
-                
+                # Unknown tokens map to unk_token_id; no need to materialize get_vocab().
                 blank_id = self.tokenizer.convert_tokens_to_ids("<epsilon>")
-               
-                if hasattr(self.tokenizer, "get_vocab") and "<epsilon>" not in self.tokenizer.get_vocab():
+                unk_token = getattr(self.tokenizer, "unk_token", None)
+                if blank_id == getattr(self.tokenizer, "unk_token_id", None) and unk_token != "<epsilon>":
                     blank_id = None
             except Exception:
                 blank_id = None
+            try:
+                special_ids = {int(i) for i in (self.tokenizer.all_special_ids or []) if i is not None}
+            except Exception:
+                special_ids = set()
         self.blank_id = blank_id
+        # Blank + special tokens are masked out during collapse, so decode can skip its own special-token pass.
+        self._special_ids = special_ids
+        drop = special_ids | ({blank_id} if blank_id is not None else set())
+        self._drop_ids = torch.tensor(sorted(drop), dtype=torch.long, device=self.device) if drop else None
+
+        if self.device.type == "cuda":
+            torch.backends.cudnn.benchmark = True
+            torch.backends.cuda.matmul.allow_tf32 = True
+            torch.set_float32_matmul_precision("high")
+            self._warmup()
+
+        quant = self.quant if (self.quant == "int8" and self.device.type == "cpu") else "off"
+        print(f"[MedASR] Loaded model={self.model_id} device={self.device.type} dtype={self.dtype} quant={quant}")
+
+    def _warmup(self) -> None:
+        # Run one silent chunk at the canonical chunk shape so cuDNN algorithm
+        # selection (and compilation, when enabled) happens before the first request.
+        try:
+            silence = np.zeros(max(1, self.chunk_length_s) * 16000, dtype=np.float32)
+            self._infer_chunks([silence])
+        except Exception as exc:
+            print(f"[MedASR] Warmup skipped: {exc}")
 
-        print(f"[MedASR] Loaded model={self.model_id} device={self.device.type} dtype={self.dtype}")
+    def _infer_chunks(self, segments: List[Any]) -> List[str]:
+        return [text for texts, _ in self._iter_batch_texts(segments) for text in texts]
 
     @torch.inference_mode()
-    def _infer_one_chunk(self, speech_16k: Any) -> str:
+    def _iter_batch_texts(self, segments: List[Any]) -> Iterator[Tuple[List[str], bool]]:
         """
-        speech_16k: 1D numpy array (float32) or list[float]
+        segments: list of 1D numpy arrays (float32) at 16 kHz.
+        Runs up to self.batch_size chunks per forward pass and yields each
+        sub-batch's texts as soon as it is decoded, with whether more remain.
         """
-        inputs = self.processor(
-            speech_16k,
+        if self._eager_forward is not None:
+            padding_kwargs = {"padding": "max_length", "max_length": self.chunk_length_s * 16000}
+        else:
+            padding_kwargs = {"padding": True}
+        # One feature-extraction pass for every chunk; sub-batches are views into it.
+        features = self.processor(
+            segments,
             sampling_rate=16000,
             return_tensors="pt",
-            padding=True,
+            **padding_kwargs,
         )
-        inputs = _to_device_and_dtype(dict(inputs), self.device, self.dtype)
-
-        outputs = self.model.generate(**inputs)  # (B, T)
-        if outputs is None:
-            return ""
-
-        ids = outputs[0].detach().cpu().tolist()
-        
-        ids = _ctc_collapse(ids, self.blank_id)
-
-        if self.tokenizer is not None:
-            text = self.tokenizer.decode(ids, skip_special_tokens=True)
-        else:
-            
-            text = self.processor.batch_decode([ids], skip_special_tokens=True)[0]
-
-        return _post_clean(str(text or ""))
+        pin = self.device.type == "cuda"
+        host: Dict[str, Any] = {
+            k: (v.pin_memory() if pin else v) if torch.is_tensor(v) else v for k, v in dict(features).items()
+        }
+        for start in range(0, len(segments), self.batch_size):
+            batch = segments[start : start + self.batch_size]
+            more = start + self.batch_size < len(segments)
+            sliced = {
+                k: v[start : start + self.batch_size] if torch.is_tensor(v) else v for k, v in host.items()
+            }
+            pad_rows = self.batch_size - len(batch) if self._eager_forward is not None else 0
+            if pad_rows > 0:
+                # Keep the compiled forward on one batch shape; padded rows are dropped below.
+                sliced = {
+                    k: torch.cat([v, v.new_zeros((pad_rows,) + tuple(v.shape[1:]))]) if torch.is_tensor(v) else v
+                    for k, v in sliced.items()
+                }
+            inputs = _to_device_and_dtype(sliced, self.device, self.dtype)
 
-    def _chunk_waveform(self, wav_path: str) -> List[Any]:
+            try:
+                outputs = self.model.generate(**inputs)  # (B, T)
+            except Exception as exc:
+                if self._eager_forward is None:
+                    raise
+                print(f"[MedASR] Compiled forward failed, reverting to eager: {exc}")
+                self.model.forward = self._eager_forward
+                self._eager_forward = None
+                outputs = self.model.generate(**inputs)
+            if outputs is None:
+                yield ["" for _ in batch], more
+                continue
+            if pad_rows > 0:
+                outputs = outputs[: len(batch)]
+
+            rows = _ctc_collapse(outputs.detach(), self._drop_ids)
+
+            if self.tokenizer is not None:
+                decoded = self.tokenizer.batch_decode(rows, skip_special_tokens=not self._special_ids)
+            else:
+                decoded = self.processor.batch_decode(rows, skip_special_tokens=True)
+
+            yield [_post_clean(str(text or "")) for text in decoded], more
+
+    def _get_resampler(self, orig_sr: int) -> Any:
+        # Resample precomputes its sinc kernel once; functional.resample rebuilt it per call.
+        resampler = self._resamplers.get(orig_sr)
+        if resampler is None:
+            import torchaudio
+
+            resampler = torchaudio.transforms.Resample(orig_freq=orig_sr, new_freq=16000).to(self.device)
+            self._resamplers[orig_sr] = resampler
+        return resampler
+
+    def _chunk_waveform(self, wav: torch.Tensor, sr: int) -> List[Any]:
        
-        import torchaudio
-
-        wav, sr = torchaudio.load(wav_path)  # (C, T)
         if wav.numel() == 0:
             return []
 
@@ -259,7 +426,7 @@ class MedASRTranscriber:
 
         # resample to 16k
         if sr != 16000:
-            wav = torchaudio.functional.resample(wav, sr, 16000)
+            wav = self._get_resampler(sr)(wav.to(self.device)).cpu()
             sr = 16000
 
         wav = wav.squeeze(0)  # (T,)
@@ -274,46 +441,58 @@ class MedASRTranscriber:
 
         step = max(1, chunk - stride)
 
+        # Chunks whose loudest frame stays below vad_ratio * the recording's
+        # peak frame energy are silence; skip them instead of running the model.
+        silence_floor = None
+        if self.vad_enabled and total >= _VAD_FRAME:
+            frame_energy = wav.unfold(0, _VAD_FRAME, _VAD_HOP).pow(2).mean(dim=-1)
+            silence_floor = float(frame_energy.max()) * self.vad_ratio
+
         chunks = []
         start = 0
         while start < total:
             end = min(total, start + chunk)
             piece = wav[start:end]
-            chunks.append(piece.cpu().numpy().astype("float32"))
+            if silence_floor is None or not self._is_silent(piece, silence_floor):
+                chunks.append(piece.cpu().numpy().astype("float32"))
             if end >= total:
                 break
             start += step
         return chunks
 
-    def transcribe(self, audio_path: str) -> str:
-        wav_path, is_temp = _normalize_audio_to_wav16k_mono(audio_path, force_resample_wav=self.force_resample_wav)
-        try:
-            if _debug_enabled():
-                try:
-                    import torchaudio
-                    w, sr = torchaudio.load(wav_path)
-                    dur = w.shape[-1] / float(sr)
-                    peak = float(w.abs().max().item())
-                    print(f"[MedASR][debug] sr={sr} dur={dur:.2f}s peak={peak:.4f} path={wav_path}")
-                except Exception as e:
-                    print(f"[MedASR][debug] torchaudio inspect failed: {e}")
-
-            segments = self._chunk_waveform(wav_path)
-            if not segments:
-                return "[empty transcript]"
-
-            texts: List[str] = []
-            for seg in segments:
-                t = self._infer_one_chunk(seg)
-                if t:
-                    texts.append(t)
-
-            merged = " ".join(texts).strip()
-            return merged if merged else "[empty transcript]"
+    @staticmethod
+    def _is_silent(piece: torch.Tensor, silence_floor: float) -> bool:
+        if piece.shape[0] < _VAD_FRAME:
+            return float(piece.pow(2).mean()) <= silence_floor
+        return float(piece.unfold(0, _VAD_FRAME, _VAD_HOP).pow(2).mean(dim=-1).max()) <= silence_floor
 
-        finally:
-            if is_temp:
-                try:
-                    os.remove(wav_path)
-                except Exception:
-                    pass
+    def transcribe_batches(self, audio_path: str) -> Iterator[Tuple[List[str], bool]]:
+        """
+        Yield (texts, more) per decoded sub-batch: the cleaned non-empty chunk
+        texts in order, and whether further sub-batches are still to decode.
+        """
+        self._ensure_ready()
+        wav, sr = _load_audio(audio_path)  # (C, T)
+        if _debug_enabled():
+            try:
+                dur = wav.shape[-1] / float(sr)
+                peak = float(wav.abs().max().item()) if wav.numel() else 0.0
+                print(f"[MedASR][debug] sr={sr} dur={dur:.2f}s peak={peak:.4f} path={audio_path}")
+            except Exception as e:
+                print(f"[MedASR][debug] inspect failed: {e}")
+
+        segments = self._chunk_waveform(wav, sr)
+        if not segments:
+            return
+
+        for texts, more in self._iter_batch_texts(segments):
+            yield [text for text in texts if text], more
+
+    def transcribe_stream(self, audio_path: str) -> Iterator[str]:
+        """Yield the cleaned text of each non-empty chunk, in order, as it is decoded."""
+        for texts, _ in self.transcribe_batches(audio_path):
+            yield from texts
+
+    def transcribe(self, audio_path: str) -> str:
+        merged = " ".join(self.transcribe_stream(audio_path)).strip()
+        return merged if merged else "[empty transcript]"
@@ -1,13 +1,18 @@
 from __future__ import annotations
 
-import json
-from typing import Any, Dict, List, Optional
+import re
+from typing import Any, Dict, Iterator, List, Optional
+
+import orjson
 
 from src.utils.care_card_prompts import build_care_card_prompt
 
 
 def _json_dumps(value: Any) -> str:
-    return json.dumps(value, ensure_ascii=False)
+    return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+
+_STRIP_CHARS = " -\t"
 
 
 def _ensure_list(value: Any, default: Optional[List[str]] = None) -> List[str]:
@@ -16,33 +21,38 @@ def _ensure_list(value: Any, default: Optional[List[str]] = None) -> List[str]:
     if value is None:
         return default
     if isinstance(value, list):
-        return [str(v) for v in value if str(v).strip()]
+        return [s for s in map(str, value) if s.strip()]
     if isinstance(value, str):
-        lines = [line.strip(" -\t") for line in value.splitlines()]
-        return [line for line in lines if line]
+        return [s for s in (line.strip(_STRIP_CHARS) for line in value.splitlines()) if s]
     return [str(value)]
 
 
-def _contains_cjk(text: str) -> bool:
-    for ch in text or "":
-        if "\u4e00" <= ch <= "\u9fff" or "\u3400" <= ch <= "\u4dbf":
-            return True
-    return False
+_CJK_RE = re.compile("[\u3400-\u4dbf\u4e00-\u9fff]")
 
 
-def _card_has_cjk(card: Dict[str, Any]) -> bool:
-    if not isinstance(card, dict):
+def _contains_cjk(text: str) -> bool:
+    # Most English cards are pure ASCII; isascii() is O(1) in CPython.
+    if not text or text.isascii():
         return False
-    fields = []
+    return _CJK_RE.search(text) is not None
+
+
+def _iter_card_text(card: Dict[str, Any]) -> Iterator[str]:
     for key in ("title", "one_liner"):
-        fields.append(str(card.get(key) or ""))
+        yield str(card.get(key) or "")
     for key in ("bullets", "red_flags", "follow_up"):
         val = card.get(key) or []
         if isinstance(val, list):
-            fields.extend([str(v) for v in val])
+            yield from map(str, val)
         else:
-            fields.append(str(val))
-    return any(_contains_cjk(text) for text in fields)
+            yield str(val)
+
+
+def _card_has_cjk(card: Dict[str, Any]) -> bool:
+    if not isinstance(card, dict):
+        return False
+    # Lazily walk the fields so the scan stops at the first CJK hit.
+    return any(map(_contains_cjk, _iter_card_text(card)))
 
 
 _MISSING_HINTS = (
@@ -70,11 +80,104 @@ _MISSING_HINTS = (
 )
 
 
+_MISSING_RE = re.compile("|".join(re.escape(k) for k in sorted(_MISSING_HINTS, key=len, reverse=True)))
+
+
 def _is_missing_hint(text: str) -> bool:
     if not text:
         return False
-    lowered = text.lower()
-    return any(k in lowered for k in _MISSING_HINTS)
+    return _MISSING_RE.search(text.lower()) is not None
+
+
+_ENGLISH_FALLBACKS: Dict[str, Dict[str, Any]] = {}
+
+_MONITOR_BULLET = "Monitor symptoms and report changes."
+_DEFAULT_BULLETS = (
+    "Follow your care team's guidance.",
+    "Rest and hydrate as tolerated.",
+    _MONITOR_BULLET,
+)
+_DEFAULT_RED_FLAGS = (
+    "Severe shortness of breath",
+    "Chest pain",
+    "Confusion or fainting",
+)
+
+_VITAL_GAP_IDS = frozenset(("missing_spo2", "missing_temp", "missing_rr", "missing_hr"))
+_LOW_DIET_RE = re.compile("intake=少|几乎|little|low")
+
+_CARD_TEMPLATES: Dict[str, Dict[str, Any]] = {
+    "missing_vitals": {
+        "type": "missing_vitals",
+        "priority": "high",
+        "suggested_card_level": "nursing",
+        "reason": "Missing vital signs (SpO2/temperature/respiratory rate/heart rate).",
+        "suggested_actions": (
+            "Measure vital signs today",
+            "Report any abnormal readings",
+        ),
+    },
+    "low_audio_quality": {
+        "type": "low_audio_quality",
+        "priority": "low",
+        "suggested_card_level": "nursing",
+        "reason": "Voice note quality is low or transcript is empty.",
+        "suggested_actions": (
+            "Use text input if possible",
+            "Speak slowly and close to the microphone",
+        ),
+    },
+    "nutrition_rest": {
+        "type": "nutrition_rest",
+        "priority": "medium",
+        "suggested_card_level": "nursing",
+        "reason": "Low intake reported.",
+        "suggested_actions": (
+            "Small frequent meals if tolerated",
+            "Ask nurse for nutrition help if needed",
+        ),
+    },
+    "sleep_rest": {
+        "type": "sleep_rest",
+        "priority": "medium",
+        "suggested_card_level": "nursing",
+        "reason": "Sleep reported as short.",
+        "suggested_actions": (
+            "Rest when possible",
+            "Reduce unnecessary activity",
+        ),
+    },
+    "hydration": {
+        "type": "hydration",
+        "priority": "medium",
+        "suggested_card_level": "nursing",
+        "reason": "Low fluid intake reported.",
+        "suggested_actions": (
+            "Sip water regularly if not restricted",
+            "Tell nurse if nausea prevents drinking",
+        ),
+    },
+    "red_flags": {
+        "type": "red_flags",
+        "priority": "high",
+        "suggested_card_level": "nursing",
+        "reason": "Risk level indicates close monitoring.",
+        "suggested_actions": (
+            "Call nurse if breathing worsens",
+            "Seek help for chest pain or confusion",
+        ),
+    },
+    "medical_plan": {
+        "type": "medical_plan",
+        "priority": "medium",
+        "suggested_card_level": "medical",
+        "reason": "Assessment available; a medical explanation may be helpful.",
+        "suggested_actions": (
+            "Explain upcoming tests or treatments",
+            "Clarify what needs doctor confirmation",
+        ),
+    },
+}
 
 
 class CareCardAgent:
@@ -89,17 +192,12 @@ class CareCardAgent:
             if msg:
                 actions.append(msg)
         if not actions:
-            actions = ["Monitor symptoms and report changes."]
-        red_flags = [
-            "Severe shortness of breath",
-            "Chest pain",
-            "Confusion or fainting",
-        ]
+            actions = [_MONITOR_BULLET]
         return {
             "title": "Care Card",
             "one_liner": "Today focus and safety tips.",
             "bullets": actions[:5],
-            "red_flags": red_flags,
+            "red_flags": list(_DEFAULT_RED_FLAGS),
             "follow_up": [],
             "boundaries": {
                 "no_prescription_changes": True,
@@ -108,47 +206,44 @@ class CareCardAgent:
         }
 
     def _normalize(self, card: Dict[str, Any], fallback: Dict[str, Any], card_level: str) -> Dict[str, Any]:
-        card = card or {}
-        title = str(card.get("title") or fallback.get("title") or "Care Card")
-        one_liner = str(card.get("one_liner") or fallback.get("one_liner") or "")
-        bullets = _ensure_list(card.get("bullets"), _ensure_list(fallback.get("bullets")))
-        red_flags = _ensure_list(card.get("red_flags"), _ensure_list(fallback.get("red_flags")))
-        follow_up = _ensure_list(card.get("follow_up"), _ensure_list(fallback.get("follow_up")))
-        if _is_missing_hint(one_liner):
-            one_liner = ""
-        bullets = [b for b in bullets if b and not _is_missing_hint(b)]
-        if not bullets:
-            bullets = [
-                "Follow your care team's guidance.",
-                "Rest and hydrate as tolerated.",
-                "Monitor symptoms and report changes.",
-            ]
-        boundaries = card.get("boundaries") if isinstance(card.get("boundaries"), dict) else {}
-        boundaries.setdefault("no_prescription_changes", True)
-        boundaries.setdefault("needs_doctor_approval", card_level == "medical")
+        card_get = (card or {}).get
+        fb_get = (fallback or {}).get
+        one_liner = str(card_get("one_liner") or fb_get("one_liner") or "")
+        bullets = [
+            b
+            for b in _ensure_list(card_get("bullets"), _ensure_list(fb_get("bullets")))
+            if b and not _is_missing_hint(b)
+        ]
+        bnd = card_get("boundaries")
+        if not isinstance(bnd, dict):
+            bnd = {}
         return {
-            "title": title,
-            "one_liner": one_liner,
-            "bullets": bullets,
-            "red_flags": red_flags,
-            "follow_up": follow_up,
-            "boundaries": boundaries,
+            "title": str(card_get("title") or fb_get("title") or "Care Card"),
+            "one_liner": "" if _is_missing_hint(one_liner) else one_liner,
+            "bullets": bullets or list(_DEFAULT_BULLETS),
+            "red_flags": _ensure_list(card_get("red_flags"), _ensure_list(fb_get("red_flags"))),
+            "follow_up": _ensure_list(card_get("follow_up"), _ensure_list(fb_get("follow_up"))),
+            "boundaries": {
+                **bnd,
+                "no_prescription_changes": bnd.get("no_prescription_changes", True),
+                "needs_doctor_approval": bnd.get("needs_doctor_approval", card_level == "medical"),
+            },
         }
 
     def _english_fallback(self, card_level: str) -> Dict[str, Any]:
+        # The fallback is constant per card_level: normalize it once, then hand
+        # out copies of its lists/dicts so callers can mutate freely.
+        cached = _ENGLISH_FALLBACKS.get(card_level)
+        if cached is None:
+            cached = _ENGLISH_FALLBACKS[card_level] = self._build_english_fallback(card_level)
+        return {k: (list(v) if isinstance(v, list) else dict(v) if isinstance(v, dict) else v) for k, v in cached.items()}
+
+    def _build_english_fallback(self, card_level: str) -> Dict[str, Any]:
         card = {
             "title": "Today's Care Card",
             "one_liner": "Daily care focus and safety tips.",
-            "bullets": [
-                "Monitor symptoms and report changes.",
-                "Rest and hydrate as tolerated.",
-                "Follow your care team's guidance.",
-            ],
-            "red_flags": [
-                "Severe shortness of breath",
-                "Chest pain",
-                "Confusion or fainting",
-            ],
+            "bullets": list(reversed(_DEFAULT_BULLETS)),
+            "red_flags": list(_DEFAULT_RED_FLAGS),
             "follow_up": [],
             "boundaries": {
                 "no_prescription_changes": True,
@@ -196,109 +291,29 @@ class CareCardAgent:
         return normalized
 
     def recommend_cards(self, gaps: List[Dict[str, Any]], timeline: Dict[str, Any]) -> List[Dict[str, Any]]:
-        recs: List[Dict[str, Any]] = []
-        gap_ids = set()
-        for g in gaps or []:
-            if isinstance(g, dict):
-                gap_ids.add(g.get("id"))
-        if {"missing_spo2", "missing_temp", "missing_rr", "missing_hr"} & gap_ids:
-            recs.append(
-                {
-                    "type": "missing_vitals",
-                    "priority": "high",
-                    "suggested_card_level": "nursing",
-                    "reason": "Missing vital signs (SpO2/temperature/respiratory rate/heart rate).",
-                    "suggested_actions": [
-                        "Measure vital signs today",
-                        "Report any abnormal readings",
-                    ],
-                }
-            )
-        if "low_audio_quality" in gap_ids:
-            recs.append(
-                {
-                    "type": "low_audio_quality",
-                    "priority": "low",
-                    "suggested_card_level": "nursing",
-                    "reason": "Voice note quality is low or transcript is empty.",
-                    "suggested_actions": [
-                        "Use text input if possible",
-                        "Speak slowly and close to the microphone",
-                    ],
-                }
-            )
+        gap_ids = {g.get("id") for g in gaps or [] if isinstance(g, dict)}
         latest_log = (timeline or {}).get("latest_daily_log") or {}
         diet_text = str(latest_log.get("diet") or "").lower()
         sleep_hours = latest_log.get("sleep_hours")
         water_ml = latest_log.get("water_ml")
-        if any(k in diet_text for k in ["intake=少", "几乎", "low", "little", "very little"]):
-            recs.append(
-                {
-                    "type": "nutrition_rest",
-                    "priority": "medium",
-                    "suggested_card_level": "nursing",
-                    "reason": "Low intake reported.",
-                    "suggested_actions": [
-                        "Small frequent meals if tolerated",
-                        "Ask nurse for nutrition help if needed",
-                    ],
-                }
-            )
-        if isinstance(sleep_hours, (int, float)) and sleep_hours <= 5:
-            recs.append(
-                {
-                    "type": "sleep_rest",
-                    "priority": "medium",
-                    "suggested_card_level": "nursing",
-                    "reason": "Sleep reported as short.",
-                    "suggested_actions": [
-                        "Rest when possible",
-                        "Reduce unnecessary activity",
-                    ],
-                }
-            )
-        if isinstance(water_ml, (int, float)) and water_ml <= 600:
-            recs.append(
-                {
-                    "type": "hydration",
-                    "priority": "medium",
-                    "suggested_card_level": "nursing",
-                    "reason": "Low fluid intake reported.",
-                    "suggested_actions": [
-                        "Sip water regularly if not restricted",
-                        "Tell nurse if nausea prevents drinking",
-                    ],
-                }
-            )
         assessment = (timeline or {}).get("latest_assessment_summary") or {}
         risk_level = str(assessment.get("risk_level") or "").lower()
-        if risk_level in ("high", "medium"):
-            recs.append(
-                {
-                    "type": "red_flags",
-                    "priority": "high",
-                    "suggested_card_level": "nursing",
-                    "reason": "Risk level indicates close monitoring.",
-                    "suggested_actions": [
-                        "Call nurse if breathing worsens",
-                        "Seek help for chest pain or confusion",
-                    ],
-                }
-            )
-        if assessment:
-            recs.append(
-                {
-                    "type": "medical_plan",
-                    "priority": "medium",
-                    "suggested_card_level": "medical",
-                    "reason": "Assessment available; a medical explanation may be helpful.",
-                    "suggested_actions": [
-                        "Explain upcoming tests or treatments",
-                        "Clarify what needs doctor confirmation",
-                    ],
-                }
-            )
-        return recs[:5]
+
+        # Rule order is the output priority order.
+        triggered = (
+            ("missing_vitals", bool(_VITAL_GAP_IDS & gap_ids)),
+            ("low_audio_quality", "low_audio_quality" in gap_ids),
+            ("nutrition_rest", _LOW_DIET_RE.search(diet_text) is not None),
+            ("sleep_rest", isinstance(sleep_hours, (int, float)) and sleep_hours <= 5),
+            ("hydration", isinstance(water_ml, (int, float)) and water_ml <= 600),
+            ("red_flags", risk_level in ("high", "medium")),
+            ("medical_plan", bool(assessment)),
+        )
+        return [
+            {**_CARD_TEMPLATES[key], "suggested_actions": list(_CARD_TEMPLATES[key]["suggested_actions"])}
+            for key, fired in triggered
+            if fired
+        ][:5]
 
     def build_qa_card(
         self,
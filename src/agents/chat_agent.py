@@ -3,6 +3,7 @@ from __future__ import annotations
 import json
 import os
 import re
+from functools import lru_cache
 from typing import Any, Dict, List, Optional
 
 from PIL import Image
@@ -18,6 +19,10 @@ def _ensure_list(value: Any) -> List[Any]:
     return [value]
 
 
+def _clean_strs(value: Any) -> List[str]:
+    return [s for s in map(str, _ensure_list(value)) if s.strip()]
+
+
 def _truncate(text: str, limit: int = 220) -> str:
     t = (text or "").strip()
     if len(t) <= limit:
@@ -25,61 +30,69 @@ def _truncate(text: str, limit: int = 220) -> str:
     return t[: limit - 3] + "..."
 
 
+_RAG_RE = re.compile(
+    r"guideline|evidence|protocol|recommend|treatment|antibiotic|pneumonia|\bcap\b"
+    r"|risk|criteria|what is|why|how to|explain"
+)
+
+
+@lru_cache(maxsize=4096)
+def _short_message_wants_rag(msg: str) -> bool:
+    if "?" in msg:
+        return True
+    return _RAG_RE.search(msg) is not None
+
+
 def _should_use_rag(message: str) -> bool:
     msg = (message or "").strip().lower()
     if not msg:
         return False
     if len(msg) >= 120:
         return True
-    if "?" in msg:
-        return True
-    keywords = [
-        "guideline",
-        "evidence",
-        "protocol",
-        "recommend",
-        "treatment",
-        "antibiotic",
-        "pneumonia",
-        "cap",
-        "risk",
-        "criteria",
-        "what is",
-        "why",
-        "how to",
-        "explain",
-    ]
-    return any(k in msg for k in keywords)
+    # Only the normalized, length-capped form reaches the cache.
+    return _short_message_wants_rag(msg)
 
 
 def _short_snippet(text: str, limit: int = 220) -> str:
     return _truncate(text or "", limit=limit)
 
 
+_VOICE_MAP = {
+    "i should": "You should",
+    "i need to": "You should",
+    "i have to": "You should",
+    "i must": "You should",
+    "i will": "You can",
+    "my cough": "your cough",
+    "my symptoms": "your symptoms",
+    "my breathing": "your breathing",
+    "my chest": "your chest",
+    "my energy": "your energy",
+    "my fever": "your fever",
+    "my pain": "your pain",
+}
+_VOICE_RE = re.compile(
+    r"\b(" + "|".join(re.escape(k) for k in _VOICE_MAP) + r")\b",
+    flags=re.I,
+)
+
+
+_VOICE_CACHE_MAX_LEN = 2048
+
+
+@lru_cache(maxsize=1024)
+def _normalize_voice_cached(text: str) -> str:
+    return _VOICE_RE.sub(lambda m: _VOICE_MAP[m.group(1).lower()], text)
+
+
 def _normalize_patient_voice(answer: str) -> str:
     text = (answer or "").strip()
     if not text:
         return text
-    replacements = [
-        (r"\bI should\b", "You should"),
-        (r"\bI need to\b", "You should"),
-        (r"\bI have to\b", "You should"),
-        (r"\bI must\b", "You should"),
-        (r"\bI will\b", "You can"),
-    ]
-    for pattern, repl in replacements:
-        text = re.sub(pattern, repl, text, flags=re.I)
-    for pattern, repl in [
-        (r"\bmy cough\b", "your cough"),
-        (r"\bmy symptoms\b", "your symptoms"),
-        (r"\bmy breathing\b", "your breathing"),
-        (r"\bmy chest\b", "your chest"),
-        (r"\bmy energy\b", "your energy"),
-        (r"\bmy fever\b", "your fever"),
-        (r"\bmy pain\b", "your pain"),
-    ]:
-        text = re.sub(pattern, repl, text, flags=re.I)
-    return text
+    # Long answers are rarely repeated; keep them out of the cache.
+    if len(text) > _VOICE_CACHE_MAX_LEN:
+        return _normalize_voice_cached.__wrapped__(text)
+    return _normalize_voice_cached(text)
 
 
 class ChatAgent:
@@ -157,8 +170,8 @@ class ChatAgent:
         answer = str(raw.get("answer") or "").strip()
         if role == "patient":
             answer = _normalize_patient_voice(answer)
-        suggested_actions = [str(x) for x in _ensure_list(raw.get("suggested_actions")) if str(x).strip()]
-        safety_flags = [str(x) for x in _ensure_list(raw.get("safety_flags")) if str(x).strip()]
+        suggested_actions = _clean_strs(raw.get("suggested_actions"))
+        safety_flags = _clean_strs(raw.get("safety_flags"))
         citations = [c for c in _ensure_list(raw.get("citations")) if isinstance(c, dict)]
         new_gaps = [g for g in _ensure_list(raw.get("new_gaps")) if isinstance(g, dict)]
         topic_tag = str(raw.get("topic_tag") or "").strip() or "other"
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import os
+from functools import lru_cache
 from typing import Any, Dict, List, Tuple
 
 
@@ -8,28 +9,39 @@ def _get_env_flag(name: str, default: str = "0") -> bool:
     return os.getenv(name, default).strip() in ("1", "true", "True", "yes", "YES")
 
 
+_STRIP_CHARS = " -\t"
+
+
 def _as_list(value: Any) -> List[str]:
     if value is None:
         return []
     if isinstance(value, list):
-        return [str(v) for v in value if str(v).strip()]
+        return [s for s in map(str, value) if s.strip()]
     if isinstance(value, str):
-        lines = [line.strip(" -\t") for line in value.splitlines()]
-        return [line for line in lines if line]
+        return [s for s in (line.strip(_STRIP_CHARS) for line in value.splitlines()) if s]
     return [str(value)]
 
 
+_BLANK_STRS = frozenset(("", "-", "--"))
+
+
+def _is_blank(value: Any) -> bool:
+    # isinstance guard keeps unhashable values (lists/dicts) away from the set lookup.
+    return value is None or (isinstance(value, str) and value in _BLANK_STRS)
+
+
 def _pick_value(data: Dict[str, Any], keys: List[str]) -> Any:
     if not isinstance(data, dict):
         return None
     for key in keys:
-        if key in data and data.get(key) not in (None, "", "-", "--"):
-            return data.get(key)
+        value = data.get(key)
+        if not _is_blank(value):
+            return value
     return None
 
 
 def _fmt_optional(value: Any, suffix: str = "") -> str:
-    if value in (None, "", "-", "--"):
+    if _is_blank(value):
         return "not recorded"
     text = str(value).strip()
     if not text:
@@ -37,9 +49,25 @@ def _fmt_optional(value: Any, suffix: str = "") -> str:
     return f"{text}{suffix}" if suffix else text
 
 
+_SCALAR_TYPES = (str, int, float, bool, type(None))
+
+
 def _format_vitals_text(vitals: Any) -> str:
     if not isinstance(vitals, dict) or not vitals:
         return "not recorded"
+    # Vitals rarely change between handovers; memoize on a hashable projection.
+    # The value type is part of the key so 98 / 98.0 / True do not collide.
+    if all(isinstance(k, str) and isinstance(v, _SCALAR_TYPES) for k, v in vitals.items()):
+        return _format_vitals_cached(tuple(sorted((k, type(v).__name__, v) for k, v in vitals.items())))
+    return _format_vitals_uncached(vitals)
+
+
+@lru_cache(maxsize=512)
+def _format_vitals_cached(items: Tuple[Tuple[str, str, Any], ...]) -> str:
+    return _format_vitals_uncached({k: v for k, _, v in items})
+
+
+def _format_vitals_uncached(vitals: Dict[str, Any]) -> str:
     temp = _pick_value(vitals, ["temperature_c", "temperature"])
     hr = _pick_value(vitals, ["heart_rate", "hr"])
     rr = _pick_value(vitals, ["resp_rate", "respiratory_rate", "rr"])
@@ -78,15 +106,17 @@ def build_sbar_skeleton(
     actions = _as_list(risk_snapshot.get("next_actions") or [])
 
     vitals = latest_admin.get("vitals_json") or {}
+    diet = latest_log.get("diet")
+    water = latest_log.get("water_ml")
+    sleep = latest_log.get("sleep_hours")
     sbar_lines: List[str] = []
-    key_points: List[str] = []
 
     if lang.startswith("zh"):
         sbar_lines.append(f"**S（现状）**：风险灯={risk_level.upper()}。{flags[0] if flags else '暂无明显红旗。'}")
         sbar_lines.append(
             f"**B（背景）**：患者{patient.get('bed_id') or '-'}，"
             f"年龄{patient.get('age') or '-'}，性别{patient.get('sex') or '-'}。"
-            f"今日饮食{latest_log.get('diet') or '-'}，饮水{latest_log.get('water_ml') or '-'}ml，睡眠{latest_log.get('sleep_hours') or '-'}小时。"
+            f"今日饮食{diet or '-'}，饮水{water or '-'}ml，睡眠{sleep or '-'}小时。"
         )
         sbar_lines.append(
             f"**A（评估）**：最新体征{vitals or '-'}；"
@@ -95,9 +125,9 @@ def build_sbar_skeleton(
         )
         sbar_lines.append(f"**R（建议）**：{actions[:3] if actions else ['继续观察，必要时通知医生。']}")
     else:
-        diet_text = _fmt_optional(latest_log.get("diet"))
-        water_text = _fmt_optional(latest_log.get("water_ml"), " ml")
-        sleep_text = _fmt_optional(latest_log.get("sleep_hours"), " hrs")
+        diet_text = _fmt_optional(diet)
+        water_text = _fmt_optional(water, " ml")
+        sleep_text = _fmt_optional(sleep, " hrs")
         vitals_text = _format_vitals_text(vitals)
         dx_text = _fmt_optional(latest_assessment.get("primary_diagnosis"))
         risk_text = _fmt_optional(latest_assessment.get("risk_level"))
@@ -115,9 +145,8 @@ def build_sbar_skeleton(
         )
         sbar_lines.append(f"**R (Recommendation)**: {rec_text}.")
 
-    key_points.extend(flags[:3])
-    key_points.extend(actions[:3])
-    return "\n".join(sbar_lines), key_points[:6]
+    # At most three of each; the old trailing [:6] was therefore a no-op.
+    return "\n".join(sbar_lines), flags[:3] + actions[:3]
 
 
 class HandoverAgent:
@@ -2,8 +2,13 @@
 import os
 import re
 import gc
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 from typing import Any, Dict, Optional, List, Tuple
 
+import numpy as np
 import torch
 from PIL import Image
 from transformers import (
@@ -17,6 +22,17 @@ from src.utils.prompts import SYSTEM_PROMPT
 
 FORCE_CUDA_ENV = "FORCE_CUDA"
 MEDSIGLIP_DEVICE_ENV = "MEDSIGLIP_DEVICE"
+MEDGEMMA_QUANT_ENV = "MEDGEMMA_QUANT"  # bf16 | nf4 | int8
+MEDSIGLIP_QUANT_ENV = "MEDSIGLIP_QUANT"  # none | int8 | fp8
+MEDGEMMA_COMPILE_ENV = "MEDGEMMA_COMPILE"
+MEDSIGLIP_COMPILE_ENV = "MEDSIGLIP_COMPILE"
+ATTN_IMPL_ENV = "ATTN_IMPL"  # flash_attention_2 | sdpa | eager
+MEDGEMMA_BACKEND_ENV = "MEDGEMMA_BACKEND"  # hf | vllm
+MEDSIGLIP_GPU_PREPROC_ENV = "MEDSIGLIP_GPU_PREPROC"
+MEDGEMMA_JSON_GRAMMAR_ENV = "MEDGEMMA_JSON_GRAMMAR"
+MEDGEMMA_OFFLOAD_VISION_ENV = "MEDGEMMA_OFFLOAD_VISION"
+MEDSIGLIP_PRECHECK_ENV = "MEDSIGLIP_PRECHECK"
+MEDGEMMA_KV_CACHE_ENV = "MEDGEMMA_KV_CACHE"  # auto | fp8
 _REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
 DEFAULT_HF_CACHE_DIR = os.path.join(_REPO_ROOT, "models")
 
@@ -47,6 +63,10 @@ def _resolve_runtime_device(force_cuda: bool, device_env_name: str, default_mode
     return "cuda" if torch.cuda.is_available() else "cpu"
 
 
+def _flag_env(name: str, default: str) -> bool:
+    return os.getenv(name, default).strip().lower() in ("1", "true", "yes", "y")
+
+
 def _int_env(name: str, default: int, minimum: int, maximum: int) -> int:
     try:
         value = int(os.getenv(name, str(default)))
@@ -67,15 +87,131 @@ def _from_pretrained_compat(fn, *, token: Optional[str], **kwargs):
         return fn(**kwargs)
 
 
+@lru_cache(maxsize=4)
+def _get_processor(model_id: str, token: Optional[str]) -> Any:
+    # Processors are read-only after load; clients of the same checkpoint share one.
+    return _from_pretrained_compat(
+        AutoProcessor.from_pretrained,
+        token=token,
+        pretrained_model_name_or_path=model_id,
+        cache_dir=DEFAULT_HF_CACHE_DIR,
+    )
+
+
+def _default_attn_implementation() -> str:
+    configured = os.getenv(ATTN_IMPL_ENV, "").strip()
+    if configured:
+        return configured
+    if torch.cuda.is_available():
+        try:
+            import flash_attn  # noqa: F401
+
+            return "flash_attention_2"
+        except Exception:
+            pass
+    return "sdpa"
+
+
+def _from_pretrained_attn(fn, *, token: Optional[str], **kwargs):
+    attn = _default_attn_implementation()
+    try:
+        return _from_pretrained_compat(fn, token=token, attn_implementation=attn, **kwargs)
+    except (ImportError, ValueError) as exc:
+        if attn == "sdpa":
+            raise
+        print(f"[Observer] attn_implementation={attn} unavailable ({exc}); using sdpa")
+        return _from_pretrained_compat(fn, token=token, attn_implementation="sdpa", **kwargs)
+
+
+def _bnb_quant_config(mode: str, compute_dtype: torch.dtype) -> Optional[Any]:
+    if mode not in ("nf4", "int8"):
+        return None
+    if not torch.cuda.is_available():
+        print(f"[MedGemma] {MEDGEMMA_QUANT_ENV}={mode} needs CUDA; loading unquantized")
+        return None
+    try:
+        from transformers import BitsAndBytesConfig
+        import bitsandbytes  # noqa: F401
+    except Exception as exc:
+        print(f"[MedGemma] bitsandbytes unavailable ({exc}); loading unquantized")
+        return None
+    if mode == "int8":
+        return BitsAndBytesConfig(load_in_8bit=True)
+    return BitsAndBytesConfig(
+        load_in_4bit=True,
+        bnb_4bit_quant_type="nf4",
+        bnb_4bit_compute_dtype=compute_dtype,
+        bnb_4bit_use_double_quant=True,
+    )
+
+
+def _torchao_weight_only(model: Any, mode: str) -> str:
+    if mode not in ("fp8", "int8") or not torch.cuda.is_available():
+        return "none"
+    if mode == "fp8" and torch.cuda.get_device_capability() < (8, 9):
+        mode = "int8"  # FP8 GEMMs need Ada/Hopper
+    try:
+        from torchao.quantization import float8_weight_only, int8_weight_only, quantize_
+    except Exception as exc:
+        print(f"[MedSigLIP] torchao unavailable ({exc}); loading unquantized")
+        return "none"
+    quantize_(model, float8_weight_only() if mode == "fp8" else int8_weight_only())
+    return mode
+
+
+_GENERIC_LABEL_RE = re.compile(r"LABEL_\d+")
+_PNEUMONIA_TOKENS = ("pneumonia", "consolidation")
+
+
 def _is_label_interpretable(label: str) -> bool:
     if not label:
         return False
-    
-    if re.match(r"^LABEL_\d+$", label.strip()):
+    # Untrained classification heads expose placeholder names like LABEL_3.
+    return _GENERIC_LABEL_RE.fullmatch(label.strip()) is None
+
+
+def _softmax_topk(logits: torch.Tensor, k: int) -> Tuple[torch.Tensor, torch.Tensor]:
+    # Softmax is monotonic: rank on raw logits, then normalize only the k winners
+    # against the full logsumexp so the probabilities stay absolute.
+    top_logits, idxs = torch.topk(logits.float(), k=k, dim=-1)
+    return (top_logits - torch.logsumexp(logits.float(), dim=-1, keepdim=True)).exp(), idxs
+
+
+def _topk_to_host(vals: torch.Tensor, idxs: torch.Tensor) -> Tuple[List[List[float]], List[List[int]]]:
+    # One device->host copy for both (B, k) tensors; rounding is vectorized.
+    k = vals.shape[-1]
+    host = torch.cat([vals.float(), idxs.float()], dim=-1).cpu().numpy()
+    return np.round(host[:, :k].astype(np.float64), 4).tolist(), host[:, k:].astype(np.int64).tolist()
+
+
+def _kv_cache_8bit_enabled() -> bool:
+    if os.getenv(MEDGEMMA_KV_CACHE_ENV, "auto").strip().lower() != "fp8":
+        return False
+    if not torch.cuda.is_available() or torch.cuda.get_device_capability()[0] < 8:
+        print(f"[MedGemma] {MEDGEMMA_KV_CACHE_ENV}=fp8 needs an Ampere+ GPU; keeping the default KV cache")
         return False
     return True
 
 
+def _looks_like_radiograph(image: Image.Image) -> bool:
+    # Blank, saturated or flat frames carry no film contrast worth a ViT forward.
+    thumb = image.convert("L").resize((64, 64), Image.BILINEAR)
+    pixels = np.asarray(thumb, dtype=np.float32)
+    mean = float(pixels.mean())
+    return float(pixels.std()) >= 5.0 and 20.0 <= mean <= 230.0
+
+
+def _map_tensors(obj: Any, fn: Any) -> Any:
+    if torch.is_tensor(obj):
+        return fn(obj)
+    if isinstance(obj, (list, tuple)) and not hasattr(obj, "_fields"):
+        return type(obj)(_map_tensors(item, fn) for item in obj)
+    if isinstance(obj, dict):
+        # ModelOutput subclasses dict; rebuild through its own class to keep attribute access.
+        return type(obj)(**{k: _map_tensors(v, fn) for k, v in obj.items()})
+    return obj
+
+
 def _evidence_strength(interpretable: bool, confidence: float) -> str:
     if not interpretable:
         return "low"
@@ -108,40 +244,202 @@ class MedGemmaClient:
             torch_dtype = torch.bfloat16 if torch.cuda.is_available() else torch.float32
             device_map = "auto"
 
-        self.processor = _from_pretrained_compat(
-            AutoProcessor.from_pretrained,
-            token=token,
-            pretrained_model_name_or_path=model_id,
-            cache_dir=DEFAULT_HF_CACHE_DIR,
+        # Weight-only quantization; non-quantized modules and activations stay in torch_dtype.
+        quant_mode = os.getenv(MEDGEMMA_QUANT_ENV, "bf16").strip().lower()
+        quant_kwargs: Dict[str, Any] = {}
+        quant_config = _bnb_quant_config(quant_mode, torch_dtype)
+        if quant_config is not None:
+            quant_kwargs["quantization_config"] = quant_config
+        else:
+            quant_mode = "off"
+
+        # Keep the SigLIP tower on CPU so its HBM slice goes to KV cache instead.
+        # bnb refuses CPU-placed modules without fp32 offload, so only plain weights qualify.
+        self._pixel_device: Optional[torch.device] = None
+        offload_vision = (
+            _flag_env(MEDGEMMA_OFFLOAD_VISION_ENV, "0")
+            and torch.cuda.is_available()
+            and quant_config is None
         )
-        self.model = _from_pretrained_compat(
-            AutoModelForImageTextToText.from_pretrained,
+
+        self.processor = _get_processor(model_id, token)
+        load_kwargs: Dict[str, Any] = dict(
             token=token,
             pretrained_model_name_or_path=model_id,
             torch_dtype=torch_dtype,
-            device_map=device_map,
             cache_dir=DEFAULT_HF_CACHE_DIR,
+            **quant_kwargs,
         )
+        self.model = None
+        if offload_vision:
+            try:
+                self.model = _from_pretrained_attn(
+                    AutoModelForImageTextToText.from_pretrained,
+                    device_map={
+                        "model.vision_tower": "cpu",
+                        "model.multi_modal_projector": 0,
+                        "model.language_model": 0,
+                        "lm_head": 0,
+                    },
+                    **load_kwargs,
+                )
+                self._pixel_device = torch.device("cpu")
+            except Exception as exc:
+                print(f"[MedGemma] Vision offload failed, loading on one device: {exc}")
+        if self.model is None:
+            self.model = _from_pretrained_attn(
+                AutoModelForImageTextToText.from_pretrained,
+                device_map=device_map,
+                **load_kwargs,
+            )
         self.model.eval()
-        device = self.model.device if hasattr(self.model, "device") else "unknown"
-        print(f"[MedGemma] Loaded on device: {device} (force_cuda={force_cuda})")
+        # With a split device_map, model.device reports whichever module holds the first parameter.
+        self._text_device = (
+            self.model.get_input_embeddings().weight.device
+            if self._pixel_device is not None
+            else self.model.device
+        )
+
+        mem_fraction = os.getenv("MEDGEMMA_CUDA_MEM_FRACTION", "").strip()
+        if mem_fraction and torch.cuda.is_available():
+            try:
+                torch.cuda.set_per_process_memory_fraction(float(mem_fraction))
+            except Exception as exc:
+                print(f"[MedGemma] Ignoring MEDGEMMA_CUDA_MEM_FRACTION={mem_fraction!r}: {exc}")
+
+        # Prompt lengths vary per request, so compile with dynamic shapes rather
+        # than CUDA graphs; opt-in because the first calls pay compilation.
+        self._eager_forward = None
+        if _flag_env(MEDGEMMA_COMPILE_ENV, "0") and torch.cuda.is_available() and hasattr(torch, "compile"):
+            try:
+                self._eager_forward = self.model.forward
+                self.model.forward = torch.compile(self.model.forward, dynamic=True, fullgraph=False)
+            except Exception as exc:
+                print(f"[MedGemma] torch.compile unavailable, using eager forward: {exc}")
+                self._eager_forward = None
+
+        # Greedy JSON decoding. With a compiled forward, a static KV cache keeps
+        # decode-step shapes fixed so the graph is not re-traced per token.
+        tokenizer = getattr(self.processor, "tokenizer", None)
+        self._gen_kwargs: Dict[str, Any] = {
+            "do_sample": False,
+            "num_beams": 1,
+            "use_cache": True,
+        }
+        pad_id = getattr(tokenizer, "pad_token_id", None)
+        if pad_id is not None:
+            self._gen_kwargs["pad_token_id"] = pad_id
+        if self._eager_forward is not None:
+            self._gen_kwargs["cache_implementation"] = "static"
+        elif _kv_cache_8bit_enabled():
+            # transformers has no fp8 cache; HQQ 8-bit keys/values give the same halving
+            # while attention still runs in bf16 on dequantized blocks.
+            try:
+                import hqq  # noqa: F401
+
+                self._gen_kwargs["cache_implementation"] = "quantized"
+                self._gen_kwargs["cache_config"] = {"backend": "HQQ", "nbits": 8}
+            except Exception as exc:
+                print(f"[MedGemma] Quantized KV cache unavailable: {exc}")
+
+        # Every MedGemma prompt asks for a JSON object, but each agent uses its own
+        # shape, so constrain to generic JSON; compiled once, matcher per request.
+        self._json_grammar = None
+        if _flag_env(MEDGEMMA_JSON_GRAMMAR_ENV, "0"):
+            self._json_grammar = self._compile_json_grammar(tokenizer)
+
+        # Opt-in: vision-tower outputs keyed by image content, so repeated chat turns
+        # about the same upload skip re-encoding it. Entries live on the CPU.
+        self._image_cache_size = _int_env("MEDGEMMA_IMAGE_CACHE", 0, 0, 256)
+        self._image_cache: "OrderedDict[bytes, Any]" = OrderedDict()
+        self._image_cache_lock = threading.Lock()
+        self._tls = threading.local()
+        if self._image_cache_size > 0:
+            self._install_image_feature_cache()
+
+        device = self._text_device
+        offload_note = " vision=cpu" if self._pixel_device is not None else ""
+        print(f"[MedGemma] Loaded on device: {device}{offload_note} quant={quant_mode} (force_cuda={force_cuda})")
+
+    def _compile_json_grammar(self, tokenizer: Any) -> Optional[Any]:
+        try:
+            import xgrammar as xgr
+
+            config = getattr(self.model, "config", None)
+            text_config = getattr(config, "text_config", None) or config
+            vocab_size = getattr(text_config, "vocab_size", None) or len(tokenizer)
+            info = xgr.TokenizerInfo.from_huggingface(tokenizer, vocab_size=vocab_size)
+            return xgr.GrammarCompiler(info).compile_builtin_json_grammar()
+        except Exception as exc:
+            print(f"[MedGemma] JSON-constrained decoding unavailable: {exc}")
+            return None
+
+    def _logits_processors(self) -> Dict[str, Any]:
+        if self._json_grammar is None:
+            return {}
+        import xgrammar as xgr
+
+        return {"logits_processor": [xgr.contrib.hf.LogitsProcessor(self._json_grammar)]}
+
+    def _install_image_feature_cache(self) -> None:
+        # The multimodal forward calls get_image_features on the inner model; an
+        # instance attribute shadows the method without re-implementing the merge.
+        owner = getattr(self.model, "model", None)
+        if owner is None or not hasattr(owner, "get_image_features"):
+            owner = self.model if hasattr(self.model, "get_image_features") else None
+        if owner is None:
+            return
+        original = owner.get_image_features
+
+        def cached_image_features(pixel_values, *args, **kwargs):
+            key = getattr(self._tls, "image_key", None)
+            if key is None or pixel_values.shape[0] != 1:
+                return original(pixel_values, *args, **kwargs)
+            with self._image_cache_lock:
+                hit = self._image_cache.get(key)
+                if hit is not None:
+                    self._image_cache.move_to_end(key)
+            if hit is not None:
+                return _map_tensors(hit, lambda t: t.to(pixel_values.device, non_blocking=True))
+            out = original(pixel_values, *args, **kwargs)
+            # Park a host copy so cached features never hold HBM the OOM ladder needs.
+            host = _map_tensors(out, lambda t: t.detach().to("cpu"))
+            with self._image_cache_lock:
+                self._image_cache[key] = host
+                while len(self._image_cache) > self._image_cache_size:
+                    self._image_cache.popitem(last=False)
+            return out
+
+        owner.get_image_features = cached_image_features
+
+    @staticmethod
+    def _image_key(image: Image.Image) -> bytes:
+        h = hashlib.blake2b(digest_size=16)
+        h.update(f"{image.mode}:{image.size}".encode("utf-8"))
+        h.update(image.tobytes())
+        return h.digest()
 
     @staticmethod
     def _is_oom_error(exc: BaseException) -> bool:
         text = str(exc).lower()
         return "out of memory" in text or "cuda error: out of memory" in text
 
-    @staticmethod
-    def _cleanup_cuda() -> None:
+    def _cleanup_cuda(self) -> None:
+        with self._image_cache_lock:
+            self._image_cache.clear()
         if not torch.cuda.is_available():
             return
         try:
-            gc.collect()
+            # A full gc walk costs hundreds of ms on a large process and rarely frees
+            # tensors (the live traceback still pins the failed attempt's frames).
+            if _flag_env("MEDGEMMA_FULL_GC", "0"):
+                gc.collect()
             torch.cuda.empty_cache()
+            torch.cuda.reset_peak_memory_stats()
         except Exception:
             pass
 
-    def _build_inputs(self, messages: List[Dict[str, Any]]) -> Dict[str, torch.Tensor]:
+    def _build_inputs(self, messages: List[Any], **template_kwargs: Any) -> Dict[str, torch.Tensor]:
         raw = self.processor.apply_chat_template(
             messages,
             add_generation_prompt=True,
@@ -150,33 +448,115 @@ class MedGemmaClient:
             return_tensors="pt",
             truncation=True,
             max_length=self.max_input_tokens,
+            **template_kwargs,
         )
-        model_device = self.model.device
+        model_device = self._text_device
         model_dtype = self.model.dtype if hasattr(self.model, "dtype") else (
             torch.bfloat16 if model_device.type == "cuda" and torch.cuda.is_bf16_supported() else (
                 torch.float16 if model_device.type == "cuda" else torch.float32
             )
         )
+        # Pinned staging lets the H2D copies run asynchronously on the current
+        # stream; generate() queues behind them, so no explicit sync is needed.
+        pin = model_device.type == "cuda"
         inputs: Dict[str, torch.Tensor] = {}
+        pixel_device = self._pixel_device
+        token_keys: List[str] = []
         for key, value in raw.items():
             if torch.is_tensor(value):
-                tensor = value.to(model_device)
-                if tensor.is_floating_point():
-                    tensor = tensor.to(dtype=model_dtype)
-                inputs[key] = tensor
+                if pixel_device is not None and key == "pixel_values":
+                    inputs[key] = value.to(device=pixel_device, dtype=model_dtype)
+                    continue
+                if pin and not value.is_floating_point() and (
+                    not token_keys
+                    or (raw[token_keys[0]].shape == value.shape and raw[token_keys[0]].dtype == value.dtype)
+                ):
+                    token_keys.append(key)
+                    continue
+                if pin:
+                    value = value.pin_memory()
+                inputs[key] = value.to(
+                    device=model_device,
+                    dtype=model_dtype if value.is_floating_point() else value.dtype,
+                    non_blocking=pin,
+                )
+        if token_keys:
+            # input_ids / attention_mask / token_type_ids share one [B, L] shape:
+            # stack them so a single pinned H2D copy replaces one per tensor.
+            packed = torch.stack([raw[key] for key in token_keys]).pin_memory()
+            packed = packed.to(device=model_device, non_blocking=True)
+            inputs.update(zip(token_keys, packed.unbind(0)))
         return inputs
 
     def _generate_json(self, messages: List[Dict[str, Any]], max_new_tokens: int) -> Dict[str, Any]:
-        inputs = self._build_inputs(messages)
+        return safe_json_loads(self._generate_texts(messages, max_new_tokens)[0])
+
+    def _generate_texts(self, messages: List[Any], max_new_tokens: int, **template_kwargs: Any) -> List[str]:
+        inputs = self._build_inputs(messages, **template_kwargs)
         with torch.inference_mode():
-            output = self.model.generate(**inputs, max_new_tokens=max_new_tokens)
-        generated_text = self.processor.decode(
-            output[0][inputs["input_ids"].shape[-1] :], skip_special_tokens=True
+            try:
+                output = self.model.generate(
+                    **inputs, max_new_tokens=max_new_tokens, **self._gen_kwargs, **self._logits_processors()
+                )
+            except Exception as exc:
+                if self._eager_forward is None or self._is_oom_error(exc):
+                    raise
+                print(f"[MedGemma] Compiled forward failed, reverting to eager: {exc}")
+                self.model.forward = self._eager_forward
+                self._eager_forward = None
+                self._gen_kwargs.pop("cache_implementation", None)
+                output = self.model.generate(
+                    **inputs, max_new_tokens=max_new_tokens, **self._gen_kwargs, **self._logits_processors()
+                )
+        return self.processor.batch_decode(
+            output[:, inputs["input_ids"].shape[-1] :], skip_special_tokens=True
         )
-        return safe_json_loads(generated_text)
+
+    @property
+    def concurrent_runs(self) -> bool:
+        # Eager generate() builds a fresh DynamicCache per call, so two threads can
+        # decode side by side; the compiled path shares one static cache on the model.
+        return self._eager_forward is None
 
     def run(
         self, prompt: str, image: Optional[Image.Image] = None, max_new_tokens: Optional[int] = None
+    ) -> Dict[str, Any]:
+        self._tls.image_key = self._image_key(image) if (image is not None and self._image_cache_size > 0) else None
+        try:
+            return self._run(prompt, image, max_new_tokens)
+        finally:
+            self._tls.image_key = None
+
+    def run_batch(
+        self,
+        prompts: List[str],
+        images: Optional[List[Optional[Image.Image]]] = None,
+        max_new_tokens: Optional[List[int]] = None,
+    ) -> List[Dict[str, Any]]:
+        """Decode text-only prompts as one left-padded batch; falls back to run() per prompt."""
+        images = images or [None] * len(prompts)
+        limits = max_new_tokens or [self.default_max_new_tokens] * len(prompts)
+        if len(prompts) > 1 and all(image is None for image in images):
+            conversations = [
+                [
+                    {"role": "system", "content": [{"type": "text", "text": SYSTEM_PROMPT}]},
+                    {"role": "user", "content": [{"type": "text", "text": prompt}]},
+                ]
+                for prompt in prompts
+            ]
+            try:
+                texts = self._generate_texts(
+                    conversations, max(int(n) for n in limits), padding=True, padding_side="left"
+                )
+                return [safe_json_loads(text) for text in texts]
+            except Exception as exc:
+                print(f"[MedGemma] Batched generation failed, running prompts one by one: {exc}")
+                if self._is_oom_error(exc):
+                    self._cleanup_cuda()
+        return [self.run(p, image=im, max_new_tokens=n) for p, im, n in zip(prompts, images, limits)]
+
+    def _run(
+        self, prompt: str, image: Optional[Image.Image], max_new_tokens: Optional[int]
     ) -> Dict[str, Any]:
         target_tokens = int(max_new_tokens or self.default_max_new_tokens)
         content = [{"type": "text", "text": prompt}]
@@ -190,7 +570,7 @@ class MedGemmaClient:
         try:
             return self._generate_json(messages, max_new_tokens=target_tokens)
         except RuntimeError as exc:
-            if self.model.device.type == "cuda" and self._is_oom_error(exc):
+            if self._text_device.type == "cuda" and self._is_oom_error(exc):
                 print(f"[MedGemma] OOM: retry with lower tokens (from {target_tokens})")
                 self._cleanup_cuda()
                 retry_tokens = min(target_tokens, self.retry_max_new_tokens)
@@ -221,6 +601,97 @@ class MedGemmaClient:
             return {"error": str(exc), "gentle_summary": "Error in processing."}
 
 
+class MedGemmaVLLMClient:
+    """MedGemma served by an in-process vLLM engine (paged KV cache, chunked prefill)."""
+
+    def __init__(self, model_id: str = "google/medgemma-1.5-4b-it") -> None:
+        from vllm import LLM, SamplingParams
+
+        self.model_id = model_id
+        token = _hf_token()
+        self.default_max_new_tokens = _int_env("MEDGEMMA_MAX_NEW_TOKENS", 384, 64, 1024)
+        self.max_input_tokens = _int_env("MEDGEMMA_MAX_INPUT_TOKENS", 3072, 512, 8192)
+        if not torch.cuda.is_available():
+            raise RuntimeError(f"{MEDGEMMA_BACKEND_ENV}=vllm requires CUDA.")
+
+        self.processor = _get_processor(model_id, token)
+        self._sampling_params = SamplingParams
+        self.engine = LLM(
+            model=model_id,
+            dtype="bfloat16" if torch.cuda.is_bf16_supported() else "float16",
+            gpu_memory_utilization=float(os.getenv("MEDGEMMA_VLLM_GPU_UTIL", "0.85")),
+            max_model_len=self.max_input_tokens + 1024,
+            enable_chunked_prefill=True,
+            download_dir=DEFAULT_HF_CACHE_DIR,
+            limit_mm_per_prompt={"image": 1},
+            kv_cache_dtype="fp8_e4m3" if _kv_cache_8bit_enabled() else "auto",
+        )
+        # vllm.LLM is not thread-safe; FastAPI workers and the orchestrator pool share it.
+        self._engine_lock = threading.Lock()
+        self._image_tokens = int(getattr(self.processor, "image_seq_length", 256) or 0)
+        print(f"[MedGemma] Loaded vLLM engine model={model_id}")
+
+    def _chat_text(self, prompt: str, image: Optional[Image.Image]) -> str:
+        content: List[Dict[str, Any]] = [{"type": "text", "text": prompt}]
+        if image is not None:
+            content.append({"type": "image"})
+        messages = [
+            {"role": "system", "content": [{"type": "text", "text": SYSTEM_PROMPT}]},
+            {"role": "user", "content": content},
+        ]
+        return self.processor.apply_chat_template(messages, add_generation_prompt=True, tokenize=False)
+
+    def _request(self, prompt: str, image: Optional[Image.Image]) -> Dict[str, Any]:
+        text_prompt = self._chat_text(prompt, image)
+        # Match the HF client's max_input_tokens cap, but trim the user prompt rather
+        # than the rendered chat so the template and image placeholder survive.
+        budget = self.max_input_tokens - (self._image_tokens if image is not None else 0)
+        tokenizer = self.processor.tokenizer
+        overflow = len(tokenizer(text_prompt, add_special_tokens=False).input_ids) - budget
+        if overflow > 0:
+            prompt_ids = tokenizer(prompt, add_special_tokens=False).input_ids
+            prompt = tokenizer.decode(prompt_ids[: max(0, len(prompt_ids) - overflow)])
+            text_prompt = self._chat_text(prompt, image)
+        request: Dict[str, Any] = {"prompt": text_prompt}
+        if image is not None:
+            request["multi_modal_data"] = {"image": image}
+        return request
+
+    def run(
+        self, prompt: str, image: Optional[Image.Image] = None, max_new_tokens: Optional[int] = None
+    ) -> Dict[str, Any]:
+        return self.run_batch([prompt], [image], [max_new_tokens or self.default_max_new_tokens])[0]
+
+    def run_batch(
+        self,
+        prompts: List[str],
+        images: Optional[List[Optional[Image.Image]]] = None,
+        max_new_tokens: Optional[List[int]] = None,
+    ) -> List[Dict[str, Any]]:
+        """Submit all prompts to the engine at once so they share its continuous batch."""
+        images = images or [None] * len(prompts)
+        limits = max_new_tokens or [self.default_max_new_tokens] * len(prompts)
+        try:
+            requests = [self._request(p, im) for p, im in zip(prompts, images)]
+            params = [self._sampling_params(max_tokens=int(n), temperature=0.0) for n in limits]
+            with self._engine_lock:
+                outputs = self.engine.generate(requests, params, use_tqdm=False)
+            return [safe_json_loads(out.outputs[0].text) for out in outputs]
+        except Exception as exc:
+            print(f"[MedGemma] Inference error: {exc}")
+            return [{"error": str(exc), "gentle_summary": "Error in processing."} for _ in prompts]
+
+
+def load_medgemma_client(model_id: str = "google/medgemma-1.5-4b-it") -> Any:
+    backend = os.getenv(MEDGEMMA_BACKEND_ENV, "hf").strip().lower()
+    if backend == "vllm":
+        try:
+            return MedGemmaVLLMClient(model_id)
+        except Exception as exc:
+            print(f"[MedGemma] vLLM backend unavailable ({exc}); falling back to transformers")
+    return MedGemmaClient(model_id)
+
+
 class MedSigLIPAnalyzer:
     
 
@@ -244,12 +715,7 @@ class MedSigLIPAnalyzer:
         self.model_id = model_id
 
        
-        self.processor = _from_pretrained_compat(
-            AutoProcessor.from_pretrained,
-            token=token,
-            pretrained_model_name_or_path=model_id,
-            cache_dir=DEFAULT_HF_CACHE_DIR,
-        )
+        self.processor = _get_processor(model_id, token)
 
       
         self.zero_shot = False
@@ -263,7 +729,7 @@ class MedSigLIPAnalyzer:
             self.zero_shot = False
 
         if self.zero_shot and self.zs_cls is not None:
-            self.model = _from_pretrained_compat(
+            self.model = _from_pretrained_attn(
                 self.zs_cls.from_pretrained,
                 token=token,
                 pretrained_model_name_or_path=model_id,
@@ -279,7 +745,149 @@ class MedSigLIPAnalyzer:
             ).to(self.device)
 
         self.model.eval()
-        print(f"[MedSigLIP] Loaded on device: {self.device} zero_shot={self.zero_shot} (force_cuda={force_cuda})")
+        quant_mode = "none"
+        if self.device == "cuda":
+            try:
+                quant_mode = _torchao_weight_only(self.model, os.getenv(MEDSIGLIP_QUANT_ENV, "none").strip().lower())
+            except Exception as exc:
+                print(f"[MedSigLIP] Weight quantization failed, keeping full precision: {exc}")
+        print(
+            f"[MedSigLIP] Loaded on device: {self.device} zero_shot={self.zero_shot} "
+            f"quant={quant_mode} (force_cuda={force_cuda})"
+        )
+
+        # Candidate labels are constant, so the text tower runs once per label set
+        # and every image only pays for the vision tower plus a small matmul.
+        self._text_feats: Dict[Tuple[str, ...], torch.Tensor] = {}
+        self._split_towers = self.zero_shot and all(
+            hasattr(self.model, name) for name in ("get_text_features", "get_image_features", "logit_scale")
+        )
+        if self._split_towers:
+            try:
+                self._text_features(self.DEFAULT_CANDIDATE_LABELS)
+            except Exception as exc:
+                print(f"[MedSigLIP] Text feature cache disabled: {exc}")
+                self._split_towers = False
+
+        # Opt-in: cheap grayscale stats on a 64x64 thumbnail skip the forward for blank
+        # uploads. The thresholds are not validated against under/overexposed films.
+        self._precheck = _flag_env(MEDSIGLIP_PRECHECK_ENV, "0")
+
+        # Resize/rescale/normalize on the GPU: upload uint8 (1/4 the bytes of the
+        # processor's float32 output) and let CUDA kernels do the rest. Opt-in until
+        # pixel_values and top-k probabilities are checked against the CPU processor
+        # on sample radiographs; resampling kernels differ slightly between PIL and torch.
+        self._gpu_preproc = None
+        if self._split_towers and self.device == "cuda" and _flag_env(MEDSIGLIP_GPU_PREPROC_ENV, "0"):
+            self._gpu_preproc = self._build_gpu_preproc()
+
+        # Opt-in, like MEDGEMMA_COMPILE: the first request pays the compile. Images are
+        # always resized to 448x448, so the vision tower compiles once with static
+        # shapes. CUDA graphs are left off: analyze() runs on pool threads.
+        self._eager_image_features = None
+        if (
+            self._split_towers
+            and self.device == "cuda"
+            and _flag_env(MEDSIGLIP_COMPILE_ENV, "0")
+            and hasattr(torch, "compile")
+        ):
+            try:
+                self._eager_image_features = self.model.get_image_features
+                self.model.get_image_features = torch.compile(
+                    self.model.get_image_features, dynamic=False, fullgraph=False
+                )
+            except Exception as exc:
+                print(f"[MedSigLIP] torch.compile unavailable, using eager vision tower: {exc}")
+                self._eager_image_features = None
+
+    def _build_gpu_preproc(self) -> Optional[Any]:
+        image_processor = getattr(self.processor, "image_processor", None)
+        if image_processor is None:
+            return None
+        try:
+            from torchvision.transforms import InterpolationMode, v2
+        except Exception as exc:
+            print(f"[MedSigLIP] torchvision v2 unavailable, using CPU preprocessing: {exc}")
+            return None
+        steps: List[Any] = []
+        if getattr(image_processor, "do_resize", True):
+            size = getattr(image_processor, "size", None) or {}
+            if not (isinstance(size, dict) and "height" in size and "width" in size):
+                return None
+            # PIL resample codes; tensor Resize only implements these three.
+            modes = {0: InterpolationMode.NEAREST, 2: InterpolationMode.BILINEAR, 3: InterpolationMode.BICUBIC}
+            resample = getattr(image_processor, "resample", 2)
+            mode = modes.get(int(getattr(resample, "value", resample)))
+            if mode is None:
+                print(f"[MedSigLIP] Resample {resample} has no GPU equivalent, using CPU preprocessing")
+                return None
+            steps.append(v2.Resize((int(size["height"]), int(size["width"])), interpolation=mode, antialias=True))
+        steps.append(v2.ToDtype(torch.float32, scale=False))
+        if getattr(image_processor, "do_rescale", True):
+            factor = float(getattr(image_processor, "rescale_factor", 1 / 255))
+            steps.append(v2.Lambda(lambda t: t * factor))
+        if getattr(image_processor, "do_normalize", True):
+            steps.append(v2.Normalize(mean=list(image_processor.image_mean), std=list(image_processor.image_std)))
+        return v2.Compose(steps)
+
+    def _pixel_values(self, images: List[Image.Image]) -> Dict[str, torch.Tensor]:
+        if self._gpu_preproc is None:
+            return self.processor(images=images, return_tensors="pt").to(self.device)
+        batch = []
+        for image in images:
+            hwc = torch.from_numpy(np.asarray(image.convert("RGB"))).pin_memory()
+            chw = hwc.to(self.device, non_blocking=True).permute(2, 0, 1)
+            batch.append(self._gpu_preproc(chw))
+        return {"pixel_values": torch.stack(batch)}
+
+    @staticmethod
+    def _unit(features: Any) -> torch.Tensor:
+        if not torch.is_tensor(features):
+            features = features.pooler_output
+        return features / features.norm(p=2, dim=-1, keepdim=True)
+
+    @torch.inference_mode()
+    def _text_features(self, labels: List[str]) -> torch.Tensor:
+        key = tuple(labels)
+        feats = self._text_feats.get(key)
+        if feats is None:
+            text_inputs = self.processor(text=list(labels), return_tensors="pt", padding=True).to(self.device)
+            feats = self._unit(self.model.get_text_features(**text_inputs))
+            if len(self._text_feats) >= 8:
+                self._text_feats.clear()
+            self._text_feats[key] = feats
+        return feats
+
+    def _zero_shot_logits(self, images: List[Image.Image], labels: List[str]) -> torch.Tensor:
+        if self._split_towers:
+            text_feats = self._text_features(labels)
+            pixel_inputs = self._pixel_values(images)
+            try:
+                image_feats = self._unit(self.model.get_image_features(**pixel_inputs))
+            except Exception as exc:
+                if self._eager_image_features is None:
+                    raise
+                print(f"[MedSigLIP] Compiled vision tower failed, reverting to eager: {exc}")
+                self.model.get_image_features = self._eager_image_features
+                self._eager_image_features = None
+                image_feats = self._unit(self.model.get_image_features(**pixel_inputs))
+            logits = image_feats @ text_feats.t().to(image_feats.dtype) * self.model.logit_scale.exp()
+            bias = getattr(self.model, "logit_bias", None)
+            return logits + bias if bias is not None else logits
+
+        inputs = self.processor(
+            images=images,
+            text=labels,
+            return_tensors="pt",
+            padding=True,
+        ).to(self.device)
+        out = self.model(**inputs)
+        logits = getattr(out, "logits_per_image", None)
+        if logits is None:
+            logits = getattr(out, "logits", None)
+        if logits is None:
+            raise RuntimeError("zero-shot model output has no logits")
+        return logits
 
     def analyze(
         self,
@@ -287,103 +895,147 @@ class MedSigLIPAnalyzer:
         candidate_labels: Optional[List[str]] = None,
         top_k: int = 5,
     ) -> Dict[str, Any]:
+        return self.analyze_batch([image], candidate_labels=candidate_labels, top_k=top_k)[0]
+
+    def analyze_batch(
+        self,
+        images: List[Image.Image],
+        candidate_labels: Optional[List[str]] = None,
+        top_k: int = 5,
+    ) -> List[Dict[str, Any]]:
+        """Score several images with one processor call and one forward pass."""
+        if not images:
+            return []
+        if not self._precheck:
+            return self._analyze_images(images, candidate_labels, top_k)
+
+        keep = [_looks_like_radiograph(image) for image in images]
+        if all(keep):
+            return self._analyze_images(images, candidate_labels, top_k)
+        scored = iter(
+            self._analyze_images([im for im, ok in zip(images, keep) if ok], candidate_labels, top_k)
+            if any(keep)
+            else []
+        )
+        return [
+            next(scored)
+            if ok
+            else {
+                "model": "MedSigLIP",
+                "mode": "failed",
+                "primary_finding": "Unknown",
+                "confidence": 0.0,
+                "top_candidates": [],
+                "interpretable": False,
+                "suggests_pneumonia": False,
+                "evidence_strength": "low",
+                "issues": ["not_radiograph_like"],
+            }
+            for ok in keep
+        ]
+
+    def _analyze_images(
+        self,
+        images: List[Image.Image],
+        candidate_labels: Optional[List[str]],
+        top_k: int,
+    ) -> List[Dict[str, Any]]:
         labels = candidate_labels or self.DEFAULT_CANDIDATE_LABELS
         issues: List[str] = []
-        top_candidates: List[Dict[str, Any]] = []
 
         # --- zero-shot path ---
         if self.zero_shot:
             try:
-                inputs = self.processor(
-                    images=image,
-                    text=labels,
-                    return_tensors="pt",
-                    padding=True,
-                ).to(self.device)
-
-                with torch.no_grad():
-                    out = self.model(**inputs)
-                    
-                    logits = getattr(out, "logits_per_image", None)
-                    if logits is None:
-                        logits = getattr(out, "logits", None)
-                    if logits is None:
-                        raise RuntimeError("zero-shot model output has no logits")
-
-                    probs = torch.softmax(logits[0], dim=-1)  # (num_labels,)
-                    k = min(int(top_k), probs.shape[-1])
-                    vals, idxs = torch.topk(probs, k=k)
-
-                for p, i in zip(vals.tolist(), idxs.tolist()):
-                    top_candidates.append({"label": labels[i], "prob": round(float(p), 4)})
-
-                primary_label = top_candidates[0]["label"] if top_candidates else "Unknown"
-                confidence = float(top_candidates[0]["prob"]) if top_candidates else 0.0
-
-                interpretable = _is_label_interpretable(primary_label)
-                if not interpretable:
-                    issues.append("vision_label_not_interpretable")
+                with torch.inference_mode():
+                    logits = self._zero_shot_logits(images, labels)
+                    k = min(int(top_k), logits.shape[-1])
+                    vals, idxs = _softmax_topk(logits, k)
 
-                suggests_pneumonia = "pneumonia" in primary_label.lower() or "consolidation" in primary_label.lower()
+                results = []
+                for row_vals, row_idxs in zip(*_topk_to_host(vals, idxs)):
+                    top_candidates = [{"label": labels[i], "prob": p} for p, i in zip(row_vals, row_idxs)]
+                    primary_label = top_candidates[0]["label"] if top_candidates else "Unknown"
+                    confidence = float(top_candidates[0]["prob"]) if top_candidates else 0.0
 
-                return {
-                    "model": "MedSigLIP",
-                    "mode": "zero_shot",
-                    "primary_finding": primary_label,
-                    "confidence": round(confidence, 4),
-                    "top_candidates": top_candidates,
-                    "interpretable": interpretable,
-                    "suggests_pneumonia": bool(suggests_pneumonia),
-                    "evidence_strength": _evidence_strength(interpretable, confidence),
-                    "issues": issues,
-                }
+                    row_issues = list(issues)
+                    interpretable = _is_label_interpretable(primary_label)
+                    if not interpretable:
+                        row_issues.append("vision_label_not_interpretable")
+
+                    lowered = primary_label.lower()
+                    suggests_pneumonia = any(token in lowered for token in _PNEUMONIA_TOKENS)
+
+                    results.append(
+                        {
+                            "model": "MedSigLIP",
+                            "mode": "zero_shot",
+                            "primary_finding": primary_label,
+                            "confidence": round(confidence, 4),
+                            "top_candidates": top_candidates,
+                            "interpretable": interpretable,
+                            "suggests_pneumonia": bool(suggests_pneumonia),
+                            "evidence_strength": _evidence_strength(interpretable, confidence),
+                            "issues": row_issues,
+                        }
+                    )
+                return results
             except Exception as exc:
                 issues.append(f"zero_shot_failed: {exc}")
                 # fallback to classification below
 
         # --- fallback classification path ---
         try:
-            inputs = self.processor(images=image, return_tensors="pt").to(self.device)
-            with torch.no_grad():
+            inputs = self.processor(images=images, return_tensors="pt").to(self.device)
+            with torch.inference_mode():
                 logits = self.model(**inputs).logits
-                probs = torch.softmax(logits, dim=-1)[0]
-                k = min(int(top_k), probs.shape[-1])
-                vals, idxs = torch.topk(probs, k=k)
+                k = min(int(top_k), logits.shape[-1])
+                # Always fetch the argmax so the primary label survives top_k=0.
+                vals, idxs = _softmax_topk(logits, max(k, 1))
 
-            for p, i in zip(vals.tolist(), idxs.tolist()):
-                label = self.model.config.id2label.get(int(i), f"LABEL_{int(i)}")
-                top_candidates.append({"label": label, "prob": round(float(p), 4)})
+            id2label = self.model.config.id2label
+            results = []
+            for row_vals, row_idxs in zip(*_topk_to_host(vals, idxs)):
+                top_candidates = [
+                    {"label": id2label.get(i, f"LABEL_{i}"), "prob": p} for p, i in zip(row_vals, row_idxs)
+                ][:k]
 
-            idx = int(idxs[0].item()) if idxs.numel() > 0 else int(probs.argmax().item())
-            label = self.model.config.id2label.get(idx, f"LABEL_{idx}")
-            confidence = float(probs[idx])
+                idx = row_idxs[0]
+                label = id2label.get(idx, f"LABEL_{idx}")
+                confidence = row_vals[0]
 
-            interpretable = _is_label_interpretable(label)
-            if not interpretable:
-                issues.append("vision_label_not_interpretable")
-            suggests_pneumonia = interpretable and ("pneumonia" in label.lower())
+                row_issues = list(issues)
+                interpretable = _is_label_interpretable(label)
+                if not interpretable:
+                    row_issues.append("vision_label_not_interpretable")
+                suggests_pneumonia = interpretable and ("pneumonia" in label.lower())
 
-            return {
-                "model": "MedSigLIP",
-                "mode": "classification_fallback",
-                "primary_finding": label,
-                "confidence": round(float(confidence), 4),
-                "top_candidates": top_candidates,
-                "interpretable": interpretable,
-                "suggests_pneumonia": bool(suggests_pneumonia),
-                "evidence_strength": _evidence_strength(interpretable, float(confidence)),
-                "issues": issues,
-            }
+                results.append(
+                    {
+                        "model": "MedSigLIP",
+                        "mode": "classification_fallback",
+                        "primary_finding": label,
+                        "confidence": round(float(confidence), 4),
+                        "top_candidates": top_candidates,
+                        "interpretable": interpretable,
+                        "suggests_pneumonia": bool(suggests_pneumonia),
+                        "evidence_strength": _evidence_strength(interpretable, float(confidence)),
+                        "issues": row_issues,
+                    }
+                )
+            return results
 
         except Exception as exc:
-            return {
-                "model": "MedSigLIP",
-                "mode": "failed",
-                "primary_finding": "Unknown",
-                "confidence": 0.0,
-                "top_candidates": [],
-                "interpretable": False,
-                "suggests_pneumonia": False,
-                "evidence_strength": "low",
-                "issues": issues + [f"vision_failed: {exc}"],
-            }
+            return [
+                {
+                    "model": "MedSigLIP",
+                    "mode": "failed",
+                    "primary_finding": "Unknown",
+                    "confidence": 0.0,
+                    "top_candidates": [],
+                    "interpretable": False,
+                    "suggests_pneumonia": False,
+                    "evidence_strength": "low",
+                    "issues": issues + [f"vision_failed: {exc}"],
+                }
+                for _ in images
+            ]
@@ -1,9 +1,15 @@
 ﻿# src/agents/orchestrator.py
+import hashlib
 import re
 import os
+import secrets
+import threading
 import time
-import uuid
-from typing import Any, Dict, Optional, List
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
+from typing import Any, Callable, Dict, Optional, List, Tuple
 from PIL import Image
 
 from src.agents.observer import MedGemmaClient, MedSigLIPAnalyzer
@@ -11,8 +17,119 @@ from src.agents.asr import MedASRTranscriber
 from src.tools.rag_engine import RAGEngine
 from src.utils.prompts import build_audit_prompt, build_diagnosis_prompt, build_reverse_prompt
 
+RAG_CACHE_SIZE = max(0, int(os.getenv("RAG_CACHE_SIZE", "128")))
+RAG_CACHE_MAX_HAMMING = max(0, int(os.getenv("RAG_CACHE_MAX_HAMMING", "6")))
+RAG_EVIDENCE_ITEM_CHARS = max(160, min(1200, int(os.getenv("RAG_EVIDENCE_ITEM_CHARS", "500"))))
+RAG_EVIDENCE_TOTAL_CHARS = max(800, min(6000, int(os.getenv("RAG_EVIDENCE_TOTAL_CHARS", "2200"))))
+_SIMHASH_TOKEN_RE = re.compile(r"[^\W\d_]+")
+
+
+def _simhash64(text: str) -> int:
+    # Near-duplicate fingerprint: letters-only tokens, so vitals/dates that differ
+    # between otherwise identical complaints do not change the key.
+    weights = [0] * 64
+    for token in set(_SIMHASH_TOKEN_RE.findall(text.lower())):
+        h = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(64):
+            weights[bit] += 1 if (h >> bit) & 1 else -1
+    return sum(1 << bit for bit, w in enumerate(weights) if w > 0)
+
+_TRANSCRIPT_WORD_RE = re.compile(r"[a-z']+")
+_EPSILON_RE = re.compile(r"<?epsilon>?", re.IGNORECASE)
+# One alternation per vital sign, fused so the note is scanned once. No
+# alternative can occur inside another group's match, so finditer misses nothing.
+_VITALS_RE = re.compile(
+    r"(?P<spo2>\bspo2\b|o2\s*sat|血氧|氧饱和)"
+    r"|(?P<temp>\btemp\b|temperature|体温|℃|°c)"
+    r"|(?P<rr>\brr\b|respiratory rate|呼吸频率|呼吸率)"
+    r"|(?P<hr>\bhr\b|heart rate|心率|脉搏)"
+)
+_VITAL_GAP_DEFS = (
+    ("spo2", "missing_spo2", "high", "缺少血氧（SpO₂），建议补充或测量。", ("spo2",)),
+    ("temp", "missing_temp", "high", "缺少体温信息，建议补充或测量。", ("temperature",)),
+    ("rr", "missing_rr", "medium", "缺少呼吸频率，建议补充。", ("resp_rate",)),
+    ("hr", "missing_hr", "medium", "缺少心率，建议补充。", ("heart_rate",)),
+)
+_VITAL_GAP_IDS = frozenset(gap_id for _, gap_id, _, _, _ in _VITAL_GAP_DEFS)
+_QUALITY_GAP_DEFS = (
+    ("audio_quality_low", "medium", "音频质量较差，建议重录或改用文字输入。", ("audio",)),
+    ("image_quality_low", "medium", "图像质量较差，建议重新拍摄避免遮挡或模糊。", ("image",)),
+)
+_HISTORY_KEY_RE = re.compile("copd|asthma|肺|immun|transplant|steroid|chemo|antibiotic|抗生素|免疫")
+
+
+def _find_vitals(text: str) -> Dict[str, bool]:
+    found = dict.fromkeys(("spo2", "temp", "rr", "hr"), False)
+    missing = len(found)
+    for match in _VITALS_RE.finditer(text):
+        if not found[match.lastgroup]:
+            found[match.lastgroup] = True
+            missing -= 1
+            if not missing:
+                break
+    return found
+
+
+def _scan_transcript(text: str) -> Dict[str, Any]:
+    lower = text.lower()
+    return {
+        # Same tally as text.count("<epsilon>") + lower.count("epsilon") in one scan:
+        # an exact "<epsilon>" token is counted by both terms.
+        "eps_count": sum(2 if m.group() == "<epsilon>" else 1 for m in _EPSILON_RE.finditer(text)),
+        "token_count": len(text.split()),
+        "words": _TRANSCRIPT_WORD_RE.findall(lower),
+        "has_pneumonia_mention": "pneumonia" in lower,
+    }
+
+
+def _is_repetitive(words: List[str], min_unique_ratio: float) -> bool:
+    # Equivalent to len(set(words)) / n < ratio, but stops hashing as soon as
+    # enough distinct words have been seen, which is typical for real speech.
+    n = float(len(words))
+    needed = int(min_unique_ratio * n)
+    while needed / n < min_unique_ratio:
+        needed += 1
+    seen = set()
+    for word in words:
+        seen.add(word)
+        if len(seen) >= needed:
+            return False
+    return True
+
+
+# Retries after a gap fix resubmit the same transcript; the result is returned
+# as immutable fields so every run still gets its own dicts and lists.
+@lru_cache(maxsize=512)
+def _audio_quality_fields(t: str) -> Tuple[float, Tuple[str, ...], bool]:
+    issues: List[str] = []
+    stats = _scan_transcript(t)
+    eps_ratio = stats["eps_count"] / float(max(1, stats["token_count"]))
+
+    if eps_ratio > 0.2:
+        issues.append("epsilon_noise_high")
+
+    words = stats["words"]
+    if len(words) >= 8:
+        if _is_repetitive(words, 0.45):
+            issues.append("repetition_high")
+    else:
+        issues.append("very_short_transcript")
+
+    score = 1.0
+    if "very_short_transcript" in issues:
+        score -= 0.35
+    if "epsilon_noise_high" in issues:
+        score -= 0.45
+    if "repetition_high" in issues:
+        score -= 0.35
+
+    score = max(0.0, min(1.0, score))
+    return round(score, 3), tuple(issues), stats["has_pneumonia_mention"]
+
 
 class AnalysisOrchestrator:
+    _QUERY_KEYS = ("chief", "history", "intern_plan", "audio_transcript", "multimodal_summary")
+
     def __init__(
         self,
         medgemma: MedGemmaClient,
@@ -24,41 +141,22 @@ class AnalysisOrchestrator:
         self.image_analyzer = image_analyzer
         self.rag_engine = rag_engine
         self.asr_transcriber = asr_transcriber
+        # ASR and vision have no data dependency on each other; run them side by side.
+        # The third worker takes the RAG prefetch issued from the partial transcript.
+        self._modality_pool = ThreadPoolExecutor(max_workers=3, thread_name_prefix="orchestrator-modality")
+        self._rag_cache: "OrderedDict[int, List[Dict[str, Any]]]" = OrderedDict()
+        self._rag_cache_lock = threading.Lock()
 
     # ---------------------------
     # Quality / gating helpers
     # ---------------------------
-    def _assess_audio_quality(self, transcript: str) -> Dict[str, Any]:
+    def _assess_audio_quality(self, transcript: str) -> Tuple[Dict[str, Any], bool]:
+        """Return the public audio-quality dict and whether the transcript mentions pneumonia."""
         t = (transcript or "").strip()
-        issues: List[str] = []
         if not t:
-            return {"audio_quality_score": 0.0, "audio_issues": ["empty_transcript"]}
-
-        eps_count = t.count("<epsilon>") + t.lower().count("epsilon")
-        token_count = max(1, len(t.split()))
-        eps_ratio = eps_count / float(token_count)
-
-        if eps_ratio > 0.2:
-            issues.append("epsilon_noise_high")
-
-        words = re.findall(r"[A-Za-z']+", t.lower())
-        if len(words) >= 8:
-            uniq_ratio = len(set(words)) / float(len(words))
-            if uniq_ratio < 0.45:
-                issues.append("repetition_high")
-        else:
-            issues.append("very_short_transcript")
-
-        score = 1.0
-        if "very_short_transcript" in issues:
-            score -= 0.35
-        if "epsilon_noise_high" in issues:
-            score -= 0.45
-        if "repetition_high" in issues:
-            score -= 0.35
-
-        score = max(0.0, min(1.0, score))
-        return {"audio_quality_score": round(score, 3), "audio_issues": issues}
+            return {"audio_quality_score": 0.0, "audio_issues": ["empty_transcript"]}, False
+        score, issues, has_pneumonia_mention = _audio_quality_fields(t)
+        return {"audio_quality_score": score, "audio_issues": list(issues)}, has_pneumonia_mention
 
     def _assess_image_quality(self, img_findings: Optional[Dict[str, Any]]) -> Dict[str, Any]:
         if not img_findings:
@@ -117,13 +215,12 @@ class AnalysisOrchestrator:
         patient_id: Optional[str] = None,
         context_snapshot: Optional[Dict[str, Any]] = None,
     ) -> Dict[str, Any]:
-        patient = dict(patient)
-        assessment_id = uuid.uuid4().hex
+        assessment_id = secrets.token_hex(16)
         tool_trace: List[Dict[str, Any]] = []
         gaps: List[Dict[str, Any]] = []
         gap_ids: set[str] = set()
         error_summary: List[str] = []
-        vital_gap_ids = {"missing_spo2", "missing_temp", "missing_rr", "missing_hr"}
+        is_patient_view = view_mode == "Patient View"
 
         def _trace_step(
             step: str,
@@ -133,8 +230,9 @@ class AnalysisOrchestrator:
             summary: str,
             error: Optional[str] = None,
             artifacts: Optional[Dict[str, Any]] = None,
+            end_time: Optional[float] = None,
         ) -> None:
-            latency_ms = int((time.monotonic() - start_time) * 1000)
+            latency_ms = int(((end_time or time.monotonic()) - start_time) * 1000)
             record = {
                 "step": step,
                 "success": bool(success),
@@ -156,7 +254,7 @@ class AnalysisOrchestrator:
         ) -> None:
             if gap_id in gap_ids:
                 return
-            if view_mode == "Patient View" and gap_id in vital_gap_ids:
+            if is_patient_view and gap_id in _VITAL_GAP_IDS:
                 severity = "low"
                 message = f"{message}（患者端可请护士/医生测量）"
             gaps.append(
@@ -174,24 +272,43 @@ class AnalysisOrchestrator:
         has_image = image is not None
         route_tag = self._route_tag(has_audio, has_image)
 
-        patient["modalities"] = {
-            "has_audio": has_audio,
-            "has_image": has_image,
-            "route_tag": route_tag,
+        # One shallow copy, seeded with the first field run() writes; the caller's
+        # dict is never mutated and nested write targets are always fresh dicts.
+        patient = {
+            **patient,
+            "modalities": {
+                "has_audio": has_audio,
+                "has_image": has_image,
+                "route_tag": route_tag,
+            },
         }
 
-        # ===== Audio -> Transcript =====
+        # ===== Launch ASR + Vision concurrently =====
         asr_start = time.monotonic()
+        asr_future = None
+        rag_prefetch: List[Any] = []
         if has_audio and self.asr_transcriber is not None:
             self._notify(progress, 0.05, "Audio: Transcribing...")
+            asr_future = self._modality_pool.submit(
+                self._timed_call, self._transcribe_with_rag_prefetch, audio_path, patient, rag_prefetch
+            )
+        vision_start = time.monotonic()
+        vision_future = None
+        if has_image and self.image_analyzer is not None:
+            self._notify(progress, 0.1, "Vision: Analyzing scan...")
+            vision_future = self._modality_pool.submit(self._timed_call, self.image_analyzer.analyze, image)
+
+        # ===== Audio -> Transcript =====
+        if asr_future is not None:
             try:
-                patient["audio_transcript"] = self.asr_transcriber.transcribe(audio_path)
+                patient["audio_transcript"], asr_end = asr_future.result()
                 _trace_step(
                     "asr",
                     asr_start,
                     True,
                     "ok",
-                    f"ASR ok, transcript_len={len(patient.get('audio_transcript', ''))}",
+                    f"ASR ok, transcript_len={len(patient['audio_transcript'])}",
+                    end_time=asr_end,
                 )
             except Exception as exc:
                 err = str(exc)
@@ -223,16 +340,17 @@ class AnalysisOrchestrator:
             patient.setdefault("audio_transcript", "")
             _trace_step("asr", asr_start, True, "skipped", "ASR skipped (no audio)")
 
-        audio_quality = self._assess_audio_quality(patient.get("audio_transcript", ""))
+        audio_transcript = patient.get("audio_transcript", "")
+        chief = patient.get("chief")
+        history = patient.get("history")
+        audio_quality, audio_mentions_pneumonia = self._assess_audio_quality(audio_transcript)
         patient["quality"] = dict(audio_quality)
 
         # ===== Vision =====
         img_findings = None
-        vision_start = time.monotonic()
-        if has_image and self.image_analyzer is not None:
-            self._notify(progress, 0.1, "Vision: Analyzing scan...")
+        if vision_future is not None:
             try:
-                img_findings = self.image_analyzer.analyze(image)
+                img_findings, vision_end = vision_future.result()
                 _trace_step(
                     "vision",
                     vision_start,
@@ -245,6 +363,7 @@ class AnalysisOrchestrator:
                         "confidence": img_findings.get("confidence"),
                         "interpretable": img_findings.get("interpretable"),
                     },
+                    end_time=vision_end,
                 )
             except Exception as exc:
                 err = str(exc)
@@ -290,8 +409,19 @@ class AnalysisOrchestrator:
         # ===== RAG evidence =====
         self._notify(progress, 0.25, "RAG: Retrieving evidence...")
         rag_start = time.monotonic()
+        # Only a prefetch that has already landed is worth reusing; never wait on one.
+        prefetched = None
+        for prefetch in rag_prefetch:
+            if not prefetch.done():
+                prefetch.cancel()
+                continue
+            exc = prefetch.exception()
+            if exc is not None:
+                print(f"[Orchestrator] RAG prefetch failed: {exc}")
+                continue
+            prefetched = prefetch.result()
         evidence_text, rag_evidence, rag_error = self._build_rag_context(
-            patient, return_evidence=True
+            patient, return_evidence=True, prefetched=prefetched
         )
         rag_used = bool((evidence_text or "").strip())
         if rag_used:
@@ -320,28 +450,34 @@ class AnalysisOrchestrator:
         patient["primary_basis_hint"] = basis
 
         # ===== Fusion summary =====
-        patient["multimodal_summary"] = self._build_fusion_summary(
-            audio_transcript=patient.get("audio_transcript", ""),
+        patient["multimodal_summary"] = multimodal_summary = self._build_fusion_summary(
+            audio_transcript=audio_transcript,
             img_findings=img_findings,
             has_audio=has_audio,
             has_image=has_image,
             audio_quality=audio_quality,
             image_quality=image_quality,
+            audio_mentions_pneumonia=audio_mentions_pneumonia,
             rag_used=rag_used,
             basis=basis,
+            route_tag=route_tag,
         )
 
         # ===== Gaps rules =====
+        # Lowercase each non-empty field as it is joined instead of copying the
+        # whole joined note a second time.
         combined_text = " ".join(
-            [
-                str(patient.get("chief", "") or ""),
-                str(patient.get("history", "") or ""),
-                str(patient.get("intern_plan", "") or ""),
-                str(patient.get("audio_transcript", "") or ""),
-            ]
-        ).lower()
-
-        if len((patient.get("chief") or "").strip()) < 10:
+            (part if isinstance(part, str) else str(part)).lower()
+            for part in (
+                chief,
+                history,
+                patient.get("intern_plan"),
+                audio_transcript,
+            )
+            if part
+        )
+
+        if len((chief or "").strip()) < 10:
             _add_gap(
                 "chief_too_short",
                 "medium",
@@ -349,22 +485,8 @@ class AnalysisOrchestrator:
                 ["chief"],
             )
 
-        history_text = (patient.get("history") or "").lower()
-        if not any(
-            k in history_text
-            for k in [
-                "copd",
-                "asthma",
-                "肺",
-                "immun",
-                "transplant",
-                "steroid",
-                "chemo",
-                "antibiotic",
-                "抗生素",
-                "免疫",
-            ]
-        ):
+        history_text = (history or "").lower()
+        if not _HISTORY_KEY_RE.search(history_text):
             _add_gap(
                 "history_missing_key",
                 "low",
@@ -372,32 +494,18 @@ class AnalysisOrchestrator:
                 ["history"],
             )
 
-        def _has_pattern(patterns: List[str]) -> bool:
-            return any(re.search(p, combined_text) for p in patterns)
+        vitals_found = _find_vitals(combined_text)
+        for vital, gap_id, severity, message, fields in _VITAL_GAP_DEFS:
+            if not vitals_found[vital]:
+                _add_gap(gap_id, severity, message, list(fields))
 
-        if not _has_pattern([r"\bspo2\b", r"o2\s*sat", r"血氧", r"氧饱和"]):
-            _add_gap("missing_spo2", "high", "缺少血氧（SpO₂），建议补充或测量。", ["spo2"])
-        if not _has_pattern([r"\btemp\b", r"temperature", r"体温", r"℃", r"°c"]):
-            _add_gap("missing_temp", "high", "缺少体温信息，建议补充或测量。", ["temperature"])
-        if not _has_pattern([r"\brr\b", r"respiratory rate", r"呼吸频率", r"呼吸率"]):
-            _add_gap("missing_rr", "medium", "缺少呼吸频率，建议补充。", ["resp_rate"])
-        if not _has_pattern([r"\bhr\b", r"heart rate", r"心率", r"脉搏"]):
-            _add_gap("missing_hr", "medium", "缺少心率，建议补充。", ["heart_rate"])
-
-        if has_audio and float(audio_quality.get("audio_quality_score", 0.0)) < 0.35:
-            _add_gap(
-                "audio_quality_low",
-                "medium",
-                "音频质量较差，建议重录或改用文字输入。",
-                ["audio"],
-            )
-        if has_image and float(image_quality.get("image_quality_score", 0.0)) < 0.35:
-            _add_gap(
-                "image_quality_low",
-                "medium",
-                "图像质量较差，建议重新拍摄避免遮挡或模糊。",
-                ["image"],
-            )
+        quality_low = (
+            has_audio and float(audio_quality.get("audio_quality_score", 0.0)) < 0.35,
+            has_image and float(image_quality.get("image_quality_score", 0.0)) < 0.35,
+        )
+        for is_low, (gap_id, severity, message, fields) in zip(quality_low, _QUALITY_GAP_DEFS):
+            if is_low:
+                _add_gap(gap_id, severity, message, list(fields))
 
         # ===== Diagnosis =====
         self._notify(progress, 0.35, "Cognitive: Generating initial diagnosis...")
@@ -479,8 +587,8 @@ class AnalysisOrchestrator:
 
         context_snapshot_used = {
             "provided": context_snapshot is not None,
-            "keys": list((context_snapshot or {}).keys())[:10],
-            "size": len(context_snapshot or {}),
+            "keys": list(islice(context_snapshot, 10)) if context_snapshot else [],
+            "size": len(context_snapshot) if context_snapshot else 0,
         }
 
         result_struct = {
@@ -495,31 +603,34 @@ class AnalysisOrchestrator:
             "diagnosis_json": r_initial,
         }
 
-        if view_mode == "Patient View":
-            return {
-                "mode": "patient",
-                "meta": meta,
-                "diagnosis": r_initial,
-                "image_findings": img_findings,
-                "audio_transcript": patient.get("audio_transcript", ""),
-                "multimodal_summary": patient.get("multimodal_summary", ""),
-                "route_tag": route_tag,
-                "primary_basis": basis,
-                "input_quality": {
-                    "audio": audio_quality,
-                    "image": image_quality,
-                },
-                "rag_evidence": rag_evidence,
-                "transcript": patient.get("audio_transcript", ""),
-                "asr_quality": audio_quality,
-                "assessment_id": assessment_id,
-                "patient_id": patient_id,
-                "context_snapshot_used": context_snapshot_used,
-                "tool_trace": tool_trace,
-                "gaps": gaps,
-                "error_summary": error_summary,
-                "result_struct": result_struct,
-            }
+        # Patient and doctor views share every field except audit/reverse, which
+        # the doctor path appends below.
+        out = {
+            "mode": "patient" if is_patient_view else "doctor",
+            "meta": meta,
+            "diagnosis": r_initial,
+            "image_findings": img_findings,
+            "audio_transcript": audio_transcript,
+            "multimodal_summary": multimodal_summary,
+            "route_tag": route_tag,
+            "primary_basis": basis,
+            "input_quality": {
+                "audio": audio_quality,
+                "image": image_quality,
+            },
+            "rag_evidence": rag_evidence,
+            "transcript": audio_transcript,
+            "asr_quality": audio_quality,
+            "assessment_id": assessment_id,
+            "patient_id": patient_id,
+            "context_snapshot_used": context_snapshot_used,
+            "tool_trace": tool_trace,
+            "gaps": gaps,
+            "error_summary": error_summary,
+            "result_struct": result_struct,
+        }
+        if is_patient_view:
+            return out
 
         # ===== Audit =====
         skip_secondary = "error" in (r_initial or {})
@@ -533,11 +644,30 @@ class AnalysisOrchestrator:
                 "Audit skipped due to diagnosis failure",
             )
         else:
+            # Audit and differential only read r_initial: decode them as one batch
+            # when the client supports it, otherwise overlap the two calls if it can.
             self._notify(progress, 0.55, "Meta-cognition: Auditing response...")
             prompt_2 = build_audit_prompt(patient, r_initial)
-            audit_start = time.monotonic()
+            prompt_3 = build_reverse_prompt(patient, r_initial)
+            audit_start = rev_start = time.monotonic()
+            batched = None
+            reverse_future = None
+            run_batch = getattr(self.medgemma, "run_batch", None)
+            if run_batch is not None:
+                try:
+                    batched, batch_end = self._timed_call(run_batch, [prompt_2, prompt_3], None, [256, 256])
+                except Exception:
+                    batched = None
+            if batched is None and getattr(self.medgemma, "concurrent_runs", False):
+                reverse_future = self._modality_pool.submit(
+                    self._timed_call, self.medgemma.run, prompt_3, None, 256
+                )
+
             try:
-                r_audit = self.medgemma.run(prompt_2, image=None, max_new_tokens=256)
+                if batched is not None:
+                    r_audit, audit_end = batched[0], batch_end
+                else:
+                    r_audit, audit_end = self._timed_call(self.medgemma.run, prompt_2, None, 256)
                 success = "error" not in r_audit
                 _trace_step(
                     "medgemma_audit",
@@ -546,6 +676,7 @@ class AnalysisOrchestrator:
                     "ok" if success else "failed",
                     "MedGemma audit ok" if success else "MedGemma audit error",
                     error=str(r_audit.get("error")) if not success else None,
+                    end_time=audit_end,
                 )
                 if not success:
                     _add_gap(
@@ -584,10 +715,14 @@ class AnalysisOrchestrator:
             )
         else:
             self._notify(progress, 0.75, "Routing: Running differential diagnosis...")
-            prompt_3 = build_reverse_prompt(patient, r_initial)
-            rev_start = time.monotonic()
             try:
-                r_reverse = self.medgemma.run(prompt_3, image=None, max_new_tokens=256)
+                if batched is not None:
+                    r_reverse, rev_end = batched[1], batch_end
+                elif reverse_future is not None:
+                    r_reverse, rev_end = reverse_future.result()
+                else:
+                    rev_start = time.monotonic()
+                    r_reverse, rev_end = self._timed_call(self.medgemma.run, prompt_3, None, 256)
                 success = "error" not in r_reverse
                 _trace_step(
                     "medgemma_reverse",
@@ -596,6 +731,7 @@ class AnalysisOrchestrator:
                     "ok" if success else "failed",
                     "MedGemma reverse ok" if success else "MedGemma reverse error",
                     error=str(r_reverse.get("error")) if not success else None,
+                    end_time=rev_end,
                 )
                 if not success:
                     _add_gap(
@@ -623,42 +759,43 @@ class AnalysisOrchestrator:
                 )
 
         self._notify(progress, 0.9, "Rendering report...")
-        result_struct.update(
-            {
-                "audit_json": r_audit,
-                "reverse_json": r_reverse,
-            }
-        )
-        return {
-            "mode": "doctor",
-            "meta": meta,
-            "diagnosis": r_initial,
-            "audit": r_audit,
-            "reverse": r_reverse,
-            "image_findings": img_findings,
-            "audio_transcript": patient.get("audio_transcript", ""),
-            "multimodal_summary": patient.get("multimodal_summary", ""),
-            "route_tag": route_tag,
-            "primary_basis": basis,
-            "input_quality": {
-                "audio": audio_quality,
-                "image": image_quality,
-            },
-            "rag_evidence": rag_evidence,
-            "transcript": patient.get("audio_transcript", ""),
-            "asr_quality": audio_quality,
-            "assessment_id": assessment_id,
-            "patient_id": patient_id,
-            "context_snapshot_used": context_snapshot_used,
-            "tool_trace": tool_trace,
-            "gaps": gaps,
-            "error_summary": error_summary,
-            "result_struct": result_struct,
-        }
+        result_struct["audit_json"] = r_audit
+        result_struct["reverse_json"] = r_reverse
+        out["audit"] = r_audit
+        out["reverse"] = r_reverse
+        return out
 
     # ---------------------------
     # Utilities
     # ---------------------------
+    def _transcribe_with_rag_prefetch(
+        self, audio_path: str, patient: Dict[str, Any], prefetch: List[Any]
+    ) -> str:
+        # When more ASR sub-batches remain after the first, query RAG with the
+        # partial transcript while they decode. run() reuses the result only if it
+        # has finished and the final query is still a near-duplicate.
+        # `patient` is run()'s working dict; it is only read here, while run()
+        # is blocked on this future, and copied before the prefetch is queued.
+        batches = getattr(self.asr_transcriber, "transcribe_batches", None)
+        if batches is None or self.rag_engine is None:
+            return self.asr_transcriber.transcribe(audio_path)
+        parts: List[str] = []
+        for texts, more in batches(audio_path):
+            parts.extend(texts)
+            if more and parts and not prefetch:
+                query_text = self._compose_query(dict(patient, audio_transcript=" ".join(parts)))
+                prefetch.append(self._modality_pool.submit(self._prefetch_rag, query_text))
+        merged = " ".join(parts).strip()
+        return merged if merged else "[empty transcript]"
+
+    def _prefetch_rag(self, query_text: str) -> Tuple[str, List[Dict[str, Any]]]:
+        return query_text, self.rag_engine.query(query_text, top_k=6)
+
+    @staticmethod
+    def _timed_call(fn: Callable[..., Any], *args: Any) -> Tuple[Any, float]:
+        result = fn(*args)
+        return result, time.monotonic()
+
     def _notify(self, progress: Optional[Any], value: float, desc: str) -> None:
         if progress is None:
             return
@@ -668,7 +805,10 @@ class AnalysisOrchestrator:
             return
 
     def _build_rag_context(
-        self, patient: Dict[str, Any], return_evidence: bool = False
+        self,
+        patient: Dict[str, Any],
+        return_evidence: bool = False,
+        prefetched: Optional[Tuple[str, List[Dict[str, Any]]]] = None,
     ):
         if self.rag_engine is None:
             return ("", [], "rag_engine_missing") if return_evidence else ""
@@ -676,16 +816,20 @@ class AnalysisOrchestrator:
         if not query_text:
             return ("", [], "empty_query") if return_evidence else ""
         try:
-            evidence = self.rag_engine.query(query_text, top_k=6)
+            if prefetched is not None and prefetched[1] and (
+                bin(_simhash64(query_text) ^ _simhash64(prefetched[0])).count("1") <= RAG_CACHE_MAX_HAMMING
+            ):
+                evidence = prefetched[1]
+            else:
+                evidence = self._query_rag_cached(query_text)
         except Exception as exc:
             return ("", [], f"rag_query_failed: {exc}") if return_evidence else ""
         if not evidence:
             return ("", [], "no_evidence") if return_evidence else ""
-        per_item_limit = max(160, min(1200, int(os.getenv("RAG_EVIDENCE_ITEM_CHARS", "500"))))
-        total_limit = max(800, min(6000, int(os.getenv("RAG_EVIDENCE_TOTAL_CHARS", "2200"))))
+        per_item_limit = RAG_EVIDENCE_ITEM_CHARS
+        remaining = RAG_EVIDENCE_TOTAL_CHARS
         lines = []
         rag_evidence = []
-        total_chars = 0
         for item in evidence:
             source_file = item.get("source_file") or ""
             source_path = item.get("source_path") or ""
@@ -706,25 +850,42 @@ class AnalysisOrchestrator:
             )
             source = source_file or source_path or "source"
             if text_full:
-                line = f"- ({source}) {text_full}"
-                if total_chars + len(line) > total_limit:
+                # len(f"- ({source}) {text_full}") without formatting a line that won't fit.
+                line_len = len(source) + len(text_full) + 5
+                if line_len > remaining:
                     break
-                lines.append(line)
-                total_chars += len(line)
+                lines.append(f"- ({source}) {text_full}")
+                remaining -= line_len
         context = "\n".join(lines)
         if return_evidence:
             return context, rag_evidence, None
         return context
 
+    def _query_rag_cached(self, query_text: str) -> List[Dict[str, Any]]:
+        if RAG_CACHE_SIZE <= 0:
+            return self.rag_engine.query(query_text, top_k=6)
+        key = _simhash64(query_text)
+        with self._rag_cache_lock:
+            hit_key = key if key in self._rag_cache else None
+            if hit_key is None:
+                for cached_key in reversed(self._rag_cache):
+                    if bin(cached_key ^ key).count("1") <= RAG_CACHE_MAX_HAMMING:
+                        hit_key = cached_key
+                        break
+            if hit_key is not None:
+                self._rag_cache.move_to_end(hit_key)
+                return self._rag_cache[hit_key]
+        evidence = self.rag_engine.query(query_text, top_k=6)
+        if evidence:
+            with self._rag_cache_lock:
+                self._rag_cache[key] = evidence
+                self._rag_cache.move_to_end(key)
+                while len(self._rag_cache) > RAG_CACHE_SIZE:
+                    self._rag_cache.popitem(last=False)
+        return evidence
+
     def _compose_query(self, patient: Dict[str, Any]) -> str:
-        parts = [
-            patient.get("chief", ""),
-            patient.get("history", ""),
-            patient.get("intern_plan", "") or "",
-            patient.get("audio_transcript", "") or "",
-            patient.get("multimodal_summary", "") or "",
-        ]
-        return " ".join(part for part in parts if part).strip()
+        return " ".join(v for k in self._QUERY_KEYS if (v := patient.get(k))).strip()
 
     def _build_fusion_summary(
         self,
@@ -734,47 +895,52 @@ class AnalysisOrchestrator:
         has_image: bool,
         audio_quality: Dict[str, Any],
         image_quality: Dict[str, Any],
+        audio_mentions_pneumonia: bool,
         rag_used: bool,
         basis: str,
+        route_tag: str,
     ) -> str:
-        lines: List[str] = []
-        lines.append(
-            f"- route_tag: {('audio_image' if (has_audio and has_image) else 'audio_only' if has_audio else 'image_only' if has_image else 'none')}"
-        )
-        lines.append(f"- primary_basis_hint: {basis}")
-        lines.append(f"- rag_used: {rag_used}")
-
+        audio_lines: Tuple[str, ...] = ()
         if has_audio:
-            t = (audio_transcript or "").strip()
-            lines.append(f"- audio_transcript_len: {len(t)}")
-            lines.append(f"- audio_quality_score: {audio_quality.get('audio_quality_score', 0.0)}")
-            if audio_quality.get("audio_issues"):
-                lines.append(f"- audio_issues: {audio_quality.get('audio_issues')}")
-
-        if has_image:
-            if img_findings:
-                lines.append(f"- vision_primary: {img_findings.get('primary_finding', 'Unknown')}")
-                lines.append(f"- vision_confidence: {img_findings.get('confidence', 'N/A')}")
-                lines.append(f"- vision_interpretable: {img_findings.get('interpretable', False)}")
-                lines.append(f"- vision_strength: {img_findings.get('evidence_strength', 'low')}")
-                lines.append(f"- image_quality_score: {image_quality.get('image_quality_score', 0.0)}")
-                if image_quality.get("image_issues"):
-                    lines.append(f"- image_issues: {image_quality.get('image_issues')}")
-            else:
-                lines.append("- image provided but vision analyzer returned no findings.")
+            audio_issues = audio_quality.get("audio_issues")
+            audio_lines = (
+                f"- audio_transcript_len: {len((audio_transcript or '').strip())}",
+                f"- audio_quality_score: {audio_quality.get('audio_quality_score', 0.0)}",
+            ) + ((f"- audio_issues: {audio_issues}",) if audio_issues else ())
+
+        image_lines: Tuple[str, ...] = ()
+        if has_image and img_findings:
+            image_issues = image_quality.get("image_issues")
+            image_lines = (
+                f"- vision_primary: {img_findings.get('primary_finding', 'Unknown')}",
+                f"- vision_confidence: {img_findings.get('confidence', 'N/A')}",
+                f"- vision_interpretable: {img_findings.get('interpretable', False)}",
+                f"- vision_strength: {img_findings.get('evidence_strength', 'low')}",
+                f"- image_quality_score: {image_quality.get('image_quality_score', 0.0)}",
+            ) + ((f"- image_issues: {image_issues}",) if image_issues else ())
+        elif has_image:
+            image_lines = ("- image provided but vision analyzer returned no findings.",)
 
         conflict_flags = []
-        at = (audio_transcript or "").lower()
-        if "pneumonia" in at and img_findings:
+        if audio_mentions_pneumonia and img_findings:
             top = str(img_findings.get("primary_finding", "")).lower()
             if "normal" in top or (
                 "no pneumothorax" in top and img_findings.get("suggests_pneumonia") is False
             ):
                 conflict_flags.append("audio_mentions_pneumonia_but_vision_top_not_pneumonia")
-        if conflict_flags:
-            lines.append(f"- potential_conflicts: {conflict_flags}")
-
-        return "FUSED INPUT SUMMARY:\n" + "\n".join(lines)
+        conflict_lines = (f"- potential_conflicts: {conflict_flags}",) if conflict_flags else ()
+
+        return "\n".join(
+            (
+                "FUSED INPUT SUMMARY:",
+                f"- route_tag: {route_tag}",
+                f"- primary_basis_hint: {basis}",
+                f"- rag_used: {rag_used}",
+            )
+            + audio_lines
+            + image_lines
+            + conflict_lines
+        )
 
 
 if __name__ == "__main__":
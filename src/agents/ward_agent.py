@@ -5,6 +5,8 @@ import uuid
 from datetime import datetime
 from typing import Any, Dict, Optional
 
+import orjson
+
 from src.agents.orchestrator import AnalysisOrchestrator
 from src.agents.chat_agent import ChatAgent
 from src.agents.care_card_agent import CareCardAgent
@@ -33,7 +35,7 @@ def _now_iso() -> str:
 def _json_dumps(value: Any) -> str:
     if isinstance(value, str):
         return value
-    return json.dumps(value, ensure_ascii=False)
+    return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
 
 
 def _json_load(value: Any, default: Any) -> Any:
@@ -42,7 +44,7 @@ def _json_load(value: Any, default: Any) -> Any:
     if isinstance(value, (dict, list)):
         return value
     try:
-        return json.loads(value)
+        return orjson.loads(value)
     except Exception:
         return default
 
@@ -296,7 +298,6 @@ class WardAgent:
         if latest_log:
             events.append(f"daily_log {latest_log.date}: diet={latest_log.diet}, water_ml={latest_log.water_ml}, sleep={latest_log.sleep_hours}")
         if latest_assessment:
-            diag = _json_load(latest_assessment.diagnosis_json, {})
             events.append(
                 f"assessment {latest_assessment.assessment_id}: primary={diag.get('primary_diagnosis')}, risk={diag.get('risk_level')}"
             )
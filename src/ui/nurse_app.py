@@ -1903,9 +1903,9 @@ def requests_generate_assessment(payload: str, state: dict):
         if not image_path or not os.path.exists(image_path):
             continue
         try:
-            from PIL import Image
+            from src.utils.image_utils import load_rgb_image
 
-            image_obj = Image.open(image_path).convert("RGB")
+            image_obj = load_rgb_image(image_path)
             break
         except Exception:
             image_obj = None
@@ -2141,9 +2141,9 @@ def assessment_generate(payload: str, state: dict):
     image_obj = None
     if image_path and os.path.exists(image_path):
         try:
-            from PIL import Image
+            from src.utils.image_utils import load_rgb_image
 
-            image_obj = Image.open(image_path).convert("RGB")
+            image_obj = load_rgb_image(image_path)
         except Exception:
             image_obj = None
 
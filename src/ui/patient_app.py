@@ -10,7 +10,7 @@ import threading
 import uuid
 import time
 from datetime import date, datetime
-from typing import Any, Optional
+from typing import Any, Mapping, Optional
 
 import gradio as gr
 
@@ -158,10 +158,10 @@ def _get_medgemma_client():
     client = _BACKEND_CACHE.get("medgemma")
     if client is not None:
         return client
-    from src.agents.observer import MedGemmaClient
+    from src.agents.observer import load_medgemma_client
 
     start = time.perf_counter()
-    client = MedGemmaClient()
+    client = load_medgemma_client()
     _log_perf("init MedGemmaClient", start)
     _BACKEND_CACHE["medgemma"] = client
     return client
@@ -1445,9 +1445,11 @@ def get_prefs(patient_id: str) -> dict:
     return _get_prefs(patient_id)
 
 
-def parse_ui_payload(payload: str) -> dict:
+def parse_ui_payload(payload: str | Mapping[str, Any]) -> dict:
     if not payload:
         return {}
+    if isinstance(payload, Mapping):
+        return dict(payload)
     try:
         data = json.loads(payload)
         if isinstance(data, dict):
@@ -1738,7 +1740,7 @@ def request_nurse_attach_audio(path: str, detail: str, page: str, state: dict):
     return state, render_patient_view(state)
 
 
-def chat_send(payload: str, image_path, state: dict):
+def chat_send(payload: str | Mapping[str, Any], image_path, state: dict):
     data = parse_ui_payload(payload)
     msg = (data.get("message") or "").strip()
     state = state or {}
@@ -1796,10 +1798,9 @@ def chat_send(payload: str, image_path, state: dict):
 
             if img_path:
                 try:
-                    from PIL import Image
+                    from src.utils.image_utils import load_rgb_image
 
-                    with Image.open(img_path) as im:
-                        chat_image_obj = im.convert("RGB").copy()
+                    chat_image_obj = load_rgb_image(img_path)
                 except Exception:
                     chat_image_obj = None
 
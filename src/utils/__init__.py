@@ -1 +1 @@
-__all__ = ["json_utils", "prompts", "rendering"]
+__all__ = ["image_utils", "json_utils", "prompts", "rendering"]
@@ -8,18 +8,11 @@ def _json(value: Any) -> str:
     return json.dumps(value, ensure_ascii=False, indent=2)
 
 
-def build_care_card_prompt(
-    role: str,
-    lang: str,
-    patient_id: str,
-    timeline: Dict[str, Any],
-    assessment_struct: Dict[str, Any],
-    card_level: str,
-    draft: Optional[Dict[str, Any]] = None,
-) -> str:
-    language = "English" if (lang or "en").lower().startswith("en") else "Chinese"
-    level_text = "nursing" if card_level == "nursing" else "medical"
-    boundaries = {
+# Static prompt sections are rendered once at import; only the patient-specific
+# timeline/assessment/draft are serialized per call.
+_BOUNDARY_TEXT = {
+    level: "- " + "\n- ".join(lines)
+    for level, lines in {
         "nursing": [
             "No prescription changes, no dosing, no definitive diagnosis statements.",
             "Plain language, short sentences, action-oriented.",
@@ -28,10 +21,11 @@ def build_care_card_prompt(
             "May mention possible tests/plans but must say 'doctor confirmation required'.",
             "Avoid definitive claims; keep uncertainty language.",
         ],
-    }
-    boundary_lines = boundaries["medical" if card_level == "medical" else "nursing"]
+    }.items()
+}
 
-    schema = {
+_SCHEMA_TEXT = _json(
+    {
         "title": "...",
         "one_liner": "...",
         "bullets": ["..."],
@@ -42,6 +36,21 @@ def build_care_card_prompt(
             "needs_doctor_approval": True,
         },
     }
+)
+
+
+def build_care_card_prompt(
+    role: str,
+    lang: str,
+    patient_id: str,
+    timeline: Dict[str, Any],
+    assessment_struct: Dict[str, Any],
+    card_level: str,
+    draft: Optional[Dict[str, Any]] = None,
+) -> str:
+    language = "English" if (lang or "en").lower().startswith("en") else "Chinese"
+    level_text = "nursing" if card_level == "nursing" else "medical"
+    boundary_text = _BOUNDARY_TEXT["medical" if card_level == "medical" else "nursing"]
 
     parts = [
         f"You are generating a {level_text} care card for patient_id={patient_id}.",
@@ -50,9 +59,9 @@ def build_care_card_prompt(
         "Do NOT mention missing data, gaps, or ask for measurements. Use available info only; if unknown, omit it.",
         "Return STRICT JSON only. No extra commentary.",
         "JSON schema:",
-        _json(schema),
+        _SCHEMA_TEXT,
         "Role boundaries:",
-        "- " + "\n- ".join(boundary_lines),
+        boundary_text,
         "Timeline (structured, short):",
         _json(timeline),
         "Latest assessment struct (lightweight):",
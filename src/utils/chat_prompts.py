@@ -11,6 +11,22 @@ def _json_dump(data: Any) -> str:
         return "{}"
 
 
+_ROLE_RULES = {
+    "patient": (
+        "Patient-facing: explain in plain language; self-care tips; when to call nurse/doctor. "
+        "Do NOT give prescriptions, dose changes, or definitive diagnosis. Use uncertainty language. "
+        "Write in second person (\"you/your\") and do not speak as the patient."
+    ),
+    "nurse": (
+        "Nurse-facing: nursing workflow, monitoring, handoff points, when to escalate to doctor. "
+        "Do NOT change prescriptions or give dosing changes."
+    ),
+    "doctor": (
+        "Doctor-facing: differential discussion, evidence, missing data, next tests; keep uncertainty and safety notes."
+    ),
+}
+
+
 def build_chat_prompt(
     role: str,
     lang: str,
@@ -24,21 +40,7 @@ def build_chat_prompt(
     lang = (lang or "en").strip().lower()
     language_hint = "English" if lang == "en" else "中文"
 
-    role_rules = {
-        "patient": (
-            "Patient-facing: explain in plain language; self-care tips; when to call nurse/doctor. "
-            "Do NOT give prescriptions, dose changes, or definitive diagnosis. Use uncertainty language. "
-            "Write in second person (\"you/your\") and do not speak as the patient."
-        ),
-        "nurse": (
-            "Nurse-facing: nursing workflow, monitoring, handoff points, when to escalate to doctor. "
-            "Do NOT change prescriptions or give dosing changes."
-        ),
-        "doctor": (
-            "Doctor-facing: differential discussion, evidence, missing data, next tests; keep uncertainty and safety notes."
-        ),
-    }
-    role_rule = role_rules.get(role, role_rules["patient"])
+    role_rule = _ROLE_RULES.get(role, _ROLE_RULES["patient"])
 
     asr_hint = ""
     if asr_quality:
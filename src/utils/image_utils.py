@@ -0,0 +1,19 @@
+import os
+
+from PIL import Image
+
+# MedGemma's vision tower takes 896px inputs and MedSigLIP 448px, so larger
+# uploads (phone photos are often 4000px+) only cost decode and resize time.
+UPLOAD_IMAGE_MAX_SIDE = int(os.getenv("UPLOAD_IMAGE_MAX_SIDE", "896"))
+
+
+def load_rgb_image(path: str, max_side: int = UPLOAD_IMAGE_MAX_SIDE) -> Image.Image:
+    with Image.open(path) as im:
+        if max_side > 0:
+            # JPEG only: let libjpeg decode at a reduced DCT scale instead of
+            # decoding the full-resolution frame and shrinking it afterwards.
+            im.draft("RGB", (max_side, max_side))
+        image = im.convert("RGB")
+    if max_side > 0 and max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.Resampling.BICUBIC)
+    return image